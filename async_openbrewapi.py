@@ -0,0 +1,274 @@
+# Author: Barrett Duna
+
+"""
+Asyncio client for the Open Brewery Database (https://www.openbrewerydb.org/)
+project API. AsyncBreweryQuery has the same queries as BreweryQuery in
+openbrewapi.py, as coroutines built on aiohttp, so that many queries can run
+at once in one event loop without blocking it:
+
+    async with AsyncBreweryQuery() as brew_query:
+        sf, dogs = await asyncio.gather(brew_query.by_city('San Francisco'),
+                                        brew_query.by_name('dog'))
+"""
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+
+from openbrewapi import Brewery, BreweryAPI, BrewerySummary, json_loads
+
+
+class AsyncBreweryQuery(BreweryAPI):
+    """
+    Queries the Open Brewery Database API from asyncio. All requests go
+    through one aiohttp.ClientSession whose connector keeps up to
+    pool_size connections alive, and at most max_concurrency requests
+    are in flight at once across every query sharing the object. Failed
+    requests (connection errors and 429, 500, 502, 503 and 504
+    responses) are retried up to max_retries times with exponential
+    backoff, honoring any Retry-After header sent by the server.
+
+    The by_* queries fetch up to max_concurrency result pages at a time
+    and stop at the first short or empty page. autocomplete hydrates its
+    hits concurrently through a least recently used by-id cache of up to
+    cache_size breweries. Cancelling a query cancels every request it
+    has in flight.
+
+    The session is created on first use inside the running event loop.
+    Call close() or use the query as an async context manager to release
+    its connections.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, base_api_url=None, session=None, pool_size=10,
+                 timeout=(3.05, 27), max_retries=3, backoff_factor=0.5,
+                 max_concurrency=10, cache_size=1024):
+        if base_api_url is not None:
+            self.base_api_url = base_api_url
+        self.session = session
+        self.pool_size = max(pool_size, max_concurrency)
+        self.timeout = aiohttp.ClientTimeout(sock_connect=timeout[0],
+                                             sock_read=timeout[1])
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_concurrency = max(1, max_concurrency)
+        self._semaphore = None
+        self.cache_size = cache_size
+        self._by_id = OrderedDict()
+
+    def _get_session(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self.session = aiohttp.ClientSession(connector=connector,
+                                                 timeout=self.timeout)
+        return self.session
+
+    def _get_semaphore(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _retry_delay(self, attempt, response=None):
+        """
+        Returns the seconds to wait before retrying: those asked for by
+        a Retry-After header of the response, given either as a number
+        of seconds or as an HTTP date, or else the exponential backoff
+        for the attempt.
+        """
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after is not None and retry_after.isdigit():
+                return int(retry_after)
+            if retry_after is not None:
+                try:
+                    when = parsedate_to_datetime(retry_after)
+                except (TypeError, ValueError):
+                    when = None
+                if when is not None:
+                    if when.tzinfo is None:
+                        when = when.replace(tzinfo=timezone.utc)
+                    return max(0.0, when.timestamp() - time.time())
+        return self.backoff_factor * 2 ** attempt
+
+    async def _get(self, url):
+        """
+        Returns the decoded JSON body of a GET request to url, retrying
+        connection errors and retryable statuses. Raises the last
+        aiohttp.ClientError once the retries are used up. A request
+        waiting to be retried gives its concurrency slot back meanwhile.
+        """
+        session = self._get_session()
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            async with self._get_semaphore():
+                try:
+                    async with session.get(url) as response:
+                        if response.status in self.RETRY_STATUSES:
+                            if last_attempt:
+                                response.raise_for_status()
+                            delay = self._retry_delay(attempt, response)
+                        else:
+                            return json_loads(await response.read())
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    if last_attempt:
+                        raise
+                    delay = self._retry_delay(attempt)
+            await asyncio.sleep(delay)
+
+    async def by_city(self, city_name):
+        return await self._query('by_city', city_name)
+
+    async def by_name(self, brewery_name):
+        return await self._query('by_name', brewery_name)
+
+    async def by_state(self, state):
+        return await self._query('by_state', state)
+
+    async def by_postal(self, postal_code):
+        return await self._query('by_postal', postal_code)
+
+    async def by_type(self, brewery_type):
+        return await self._query('by_type', brewery_type)
+
+    async def by_tag(self, tag):
+        return await self._query('by_tag', tag)
+
+    def iter_by_city(self, city_name, prefetch=True):
+        """
+        Returns an async generator of the breweries in city_name,
+        yielding each page as it arrives, with the following pages
+        requested meanwhile when prefetch is set. Close it with
+        aclose(), or iterate it inside contextlib.aclosing, to cancel
+        the requests in flight when stopping early.
+        """
+        return self._iter_query('by_city', city_name, prefetch)
+
+    def iter_by_name(self, brewery_name, prefetch=True):
+        return self._iter_query('by_name', brewery_name, prefetch)
+
+    def iter_by_state(self, state, prefetch=True):
+        return self._iter_query('by_state', state, prefetch)
+
+    def iter_by_postal(self, postal_code, prefetch=True):
+        return self._iter_query('by_postal', postal_code, prefetch)
+
+    def iter_by_type(self, brewery_type, prefetch=True):
+        return self._iter_query('by_type', brewery_type, prefetch)
+
+    def iter_by_tag(self, tag, prefetch=True):
+        return self._iter_query('by_tag', tag, prefetch)
+
+    async def get_brewery_by_id(self, id):
+        brewery = self._by_id.get(str(id))
+        if brewery is not None:
+            self._by_id.move_to_end(str(id))
+            return brewery
+        brew_dict = await self._get(self._id_api_url(id))
+        if 'message' in brew_dict:
+            raise ValueError('No brewery has id {}.'.format(id))
+        brewery = Brewery(brew_dict)
+        if self.cache_size > 0:
+            self._by_id[str(id)] = brewery
+            if len(self._by_id) > self.cache_size:
+                self._by_id.popitem(last=False)
+        return brewery
+
+    async def search(self, query):
+        brewery_dict_list = await self._get(self._search_api_url(query))
+        return [Brewery(brewery_dict) for brewery_dict in brewery_dict_list]
+
+    async def autocomplete(self, query, hydrate=True):
+        """
+        Returns the breweries suggested for query, or only their
+        BrewerySummary (id and name) with hydrate=False.
+        """
+        brewery_dict_list = await self._get(self._autocomplete_api_url(query))
+        if not brewery_dict_list:
+            raise Exception("No breweries matched the autocomplete query.")
+        if not hydrate:
+            return [BrewerySummary(brewery_dict["id"], brewery_dict["name"])
+                    for brewery_dict in brewery_dict_list]
+        return list(await asyncio.gather(
+            *(self.get_brewery_by_id(brewery_dict["id"])
+              for brewery_dict in brewery_dict_list)))
+
+    async def _request_breweries(self, key, val, page):
+        brewery_dict_list = await self._get(
+            self._assemble_api_url(key, val, page))
+        return [Brewery(brewery_dict) for brewery_dict in brewery_dict_list]
+
+    async def _pages(self, key, val, prefetch=True):
+        """
+        Yields the pages of breweries for key=val in order. The first page
+        is requested on its own, and after a full one up to
+        max_concurrency pages are in flight at once, or one without
+        prefetch. Requests still in flight are cancelled when the
+        generator finishes or is closed.
+        """
+        breweries = await self._request_breweries(key, val, 1)
+        yield breweries
+        if len(breweries) < self.RESULTS_PER_PAGE:
+            return
+        window = self.max_concurrency if prefetch else 1
+        in_flight = deque()
+        next_page = 2
+        try:
+            while True:
+                while len(in_flight) < window:
+                    in_flight.append(asyncio.ensure_future(
+                        self._request_breweries(key, val, next_page)))
+                    next_page += 1
+                breweries = await in_flight.popleft()
+                yield breweries
+                if len(breweries) < self.RESULTS_PER_PAGE:
+                    break
+        finally:
+            for task in in_flight:
+                task.cancel()
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
+    async def _iter_query(self, key, val, prefetch=True):
+        val = self._encode_val_for_api_url(val)
+        pages = self._pages(key, val, prefetch)
+        try:
+            async for breweries in pages:
+                for brewery in breweries:
+                    yield brewery
+        finally:
+            await pages.aclose()
+
+    async def _query(self, key, val):
+        rv = [brewery async for brewery in self._iter_query(key, val)]
+        if rv:
+            return rv
+        else:
+            raise Exception("No breweries found for this query.")
+
+
+if __name__ == '__main__':
+
+    async def main():
+        async with AsyncBreweryQuery() as brew_query:
+            sf_breweries, dog_breweries = await asyncio.gather(
+                brew_query.by_city('San Francisco'),
+                brew_query.by_name('dog'))
+            print(sf_breweries[0])
+            print(len(dog_breweries))
+
+    asyncio.run(main())
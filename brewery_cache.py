@@ -0,0 +1,164 @@
+# Author: Barrett Duna
+
+"""
+Response cache for BreweryQuery in openbrewapi.py. ResponseCache keeps the
+bodies of API responses keyed on their URL in a least recently used map whose
+entries expire after a time to live, with an optional SQLite file behind it
+so cached responses survive between runs. Expired responses that came with an
+ETag or Last-Modified header are kept so they can be revalidated with a
+conditional request instead of being downloaded again.
+"""
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+
+CachedResponse = namedtuple('CachedResponse',
+                            ['body', 'etag', 'last_modified', 'stored_at'])
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'revalidations',
+                                     'evictions', 'currsize'])
+
+
+def conditional_headers(entry):
+    """
+    Returns the If-None-Match and If-Modified-Since headers that
+    revalidate the cached response entry.
+    """
+    headers = {}
+    if entry.etag is not None:
+        headers['If-None-Match'] = entry.etag
+    if entry.last_modified is not None:
+        headers['If-Modified-Since'] = entry.last_modified
+    return headers
+
+
+class ResponseCache:
+    """
+    Caches response bodies by URL. At most maxsize responses are held in
+    memory, evicting the least recently used, and a response is fresh
+    for ttl seconds after it was stored or last revalidated. If path is
+    given every response is also written to an SQLite database there,
+    which is read when a URL is not in memory.
+
+    lookup(url) returns the cached response and whether it is fresh.
+    A stale response is only returned when it can be revalidated, that
+    is when it has an ETag or Last-Modified value. The cache is safe to
+    share between threads.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._revalidations = 0
+        self._evictions = 0
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                             'url TEXT PRIMARY KEY, body TEXT, etag TEXT, '
+                             'last_modified TEXT, stored_at REAL)')
+            self._db.commit()
+
+    def _load(self, url):
+        if self._db is None:
+            return None
+        row = self._db.execute('SELECT body, etag, last_modified, stored_at '
+                               'FROM responses WHERE url = ?',
+                               (url,)).fetchone()
+        return CachedResponse(*row) if row is not None else None
+
+    def _save(self, url, entry):
+        if self._db is not None:
+            self._db.execute('INSERT OR REPLACE INTO responses '
+                             'VALUES (?, ?, ?, ?, ?)', (url,) + entry)
+            self._db.commit()
+
+    def _remember(self, url, entry):
+        self._entries[url] = entry
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def _forget(self, url):
+        if self._entries.pop(url, None) is not None:
+            self._evictions += 1
+        if self._db is not None:
+            self._db.execute('DELETE FROM responses WHERE url = ?', (url,))
+            self._db.commit()
+
+    def lookup(self, url):
+        """
+        Returns (entry, fresh) for url, where entry is the cached
+        CachedResponse or None.
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                entry = self._load(url)
+                if entry is not None:
+                    self._remember(url, entry)
+            else:
+                self._entries.move_to_end(url)
+            if entry is None:
+                self._misses += 1
+                return None, False
+            if time.time() - entry.stored_at < self.ttl:
+                self._hits += 1
+                return entry, True
+            self._misses += 1
+            if entry.etag is None and entry.last_modified is None:
+                self._forget(url)
+                return None, False
+            return entry, False
+
+    def store(self, url, body, etag=None, last_modified=None):
+        """
+        Caches body as the response for url along with its validators.
+        """
+        entry = CachedResponse(body, etag, last_modified, time.time())
+        with self._lock:
+            self._remember(url, entry)
+            self._save(url, entry)
+        return entry
+
+    def revalidated(self, url, entry):
+        """
+        Marks the cached response entry for url as fresh again after the
+        server answered a conditional request with 304 Not Modified.
+        """
+        with self._lock:
+            self._revalidations += 1
+            entry = entry._replace(stored_at=time.time())
+            self._remember(url, entry)
+            self._save(url, entry)
+        return entry
+
+    def cache_info(self):
+        """
+        Returns a CacheInfo with the number of fresh hits, misses,
+        successful revalidations and evictions so far, and the number of
+        responses held in memory.
+        """
+        with self._lock:
+            return CacheInfo(self._hits, self._misses, self._revalidations,
+                             self._evictions, len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM responses')
+                self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,263 @@
+# Author: Barrett Duna
+
+"""
+Local search index over brewery names and cities, so that BreweryQuery can
+answer autocomplete and search without calling the API. Autocomplete looks
+prefixes up in sorted key arrays, a flattened prefix trie, and search ranks
+breweries by the trigrams they share with the query through an inverted
+index:
+
+    index = SearchIndex(snapshot.query('by_state', 'california'))
+    brew_query = BreweryQuery(search_index=index)
+    brew_query.autocomplete('bad')
+"""
+
+import math
+import re
+from array import array
+from bisect import bisect_left, insort
+from heapq import merge
+from itertools import chain
+
+import numpy as np
+
+
+# Keys added to a built index wait in a small sorted list until there are
+# this many, and are then merged into the main arrays in one pass.
+DELTA_SIZE = 1024
+
+_SEPARATORS = re.compile(r'[\W_]+')
+
+
+def normalize(text):
+    """
+    Returns text in lower case with every run of characters other than
+    letters and digits replaced by a single space, or '' for None.
+    """
+    if text is None:
+        return ''
+    return ' '.join(_SEPARATORS.split(str(text).lower())).strip()
+
+
+def trigrams(text):
+    """
+    Returns the set of three character substrings of the normalized text
+    padded with a space at each end, so words of one or two characters
+    still have trigrams.
+    """
+    text = ' ' + text + ' '
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _suffixes(text):
+    words = text.split(' ')
+    return [' '.join(words[i:]) for i in range(1, len(words))]
+
+
+class SearchIndex:
+    """
+    Indexes breweries by name and city. Each brewery gets a document
+    number, and all the structures hold document numbers in arrays
+    rather than references to the breweries:
+
+    - the names, and the names and cities starting from every word, are
+      kept in sorted arrays next to their document numbers, so the keys
+      with a given prefix are one contiguous slice found by bisection;
+    - every trigram of the name and city maps to an array of the
+      documents containing it.
+
+    add() indexes new breweries or replaces indexed ones with the same
+    id. Their keys go to small sorted lists that lookups merge with the
+    arrays, and are moved into the arrays DELTA_SIZE at a time.
+    remove() drops a brewery by id. Replaced and removed
+    documents are skipped by lookups until more than half of the
+    documents are stale, when the index is rebuilt.
+    """
+
+    def __init__(self, breweries=()):
+        self._build([brewery for brewery in breweries])
+
+    def _build(self, breweries):
+        self._breweries = []
+        self._doc_of_id = {}
+        self._stale = 0
+        self._grams = {}
+        self._name_lengths = array('H')
+        self._name_delta = []
+        self._word_delta = []
+        names = []
+        words = []
+        for brewery in breweries:
+            self._index(brewery, names, words)
+        self._name_keys, self._name_docs = self._sorted_arrays(names)
+        self._word_keys, self._word_docs = self._sorted_arrays(words)
+
+    def _index(self, brewery, names, words):
+        doc = self._new_doc(brewery)
+        name, city = normalize(brewery.name), normalize(brewery.city)
+        self._name_lengths.append(min(len(name), 0xffff))
+        names.append((name, doc))
+        keys = _suffixes(name)
+        if city:
+            keys.append(city)
+            keys += _suffixes(city)
+        words.extend([(key, doc) for key in keys])
+        grams = self._grams
+        for gram in trigrams(name + ' ' + city):
+            docs = grams.get(gram)
+            if docs is None:
+                docs = grams[gram] = array('I')
+            docs.append(doc)
+
+    def _sorted_arrays(self, pairs):
+        pairs.sort()
+        return ([key for key, doc in pairs],
+                array('I', [doc for key, doc in pairs]))
+
+    def _new_doc(self, brewery):
+        doc = self._doc_of_id.get(brewery.id)
+        if doc is not None:
+            self._breweries[doc] = None
+            self._stale += 1
+        doc = len(self._breweries)
+        self._breweries.append(brewery)
+        self._doc_of_id[brewery.id] = doc
+        return doc
+
+    def __len__(self):
+        return len(self._doc_of_id)
+
+    def breweries(self):
+        return [brewery for brewery in self._breweries if brewery is not None]
+
+    def add(self, breweries):
+        """
+        Indexes breweries, replacing any indexed brewery with the same id.
+        """
+        names = []
+        words = []
+        for brewery in breweries:
+            self._index(brewery, names, words)
+        for pair in names:
+            insort(self._name_delta, pair)
+        for pair in words:
+            insort(self._word_delta, pair)
+        if len(self._name_delta) + len(self._word_delta) > DELTA_SIZE:
+            self._name_keys, self._name_docs = self._merge_delta(
+                self._name_keys, self._name_docs, self._name_delta)
+            self._word_keys, self._word_docs = self._merge_delta(
+                self._word_keys, self._word_docs, self._word_delta)
+            self._name_delta = []
+            self._word_delta = []
+        self._compact()
+
+    def _merge_delta(self, keys, docs, delta):
+        """
+        Returns the arrays keys and docs with the sorted pairs of delta
+        merged in, copying the runs of the arrays between the positions
+        of the new keys as whole slices.
+        """
+        merged_keys = []
+        merged_docs = array('I')
+        start = 0
+        for key, doc in delta:
+            i = bisect_left(keys, key, start)
+            merged_keys += keys[start:i]
+            merged_docs += docs[start:i]
+            merged_keys.append(key)
+            merged_docs.append(doc)
+            start = i
+        merged_keys += keys[start:]
+        merged_docs += docs[start:]
+        return merged_keys, merged_docs
+
+    def remove(self, id):
+        """
+        Drops the brewery with the given id from the index, if it is
+        indexed.
+        """
+        doc = self._doc_of_id.pop(id, None)
+        if doc is not None:
+            self._breweries[doc] = None
+            self._stale += 1
+            self._compact()
+
+    def _compact(self):
+        if self._stale * 2 > len(self._breweries):
+            self._build(self.breweries())
+
+    def _prefix_docs(self, keys, docs, delta, prefix):
+        """
+        Yields the documents of the keys starting with prefix, in key
+        order, from both the arrays keys and docs and the delta list.
+        """
+        def pairs(keys, docs, i):
+            while i < len(keys):
+                yield keys[i], docs[i]
+                i += 1
+
+        for key, doc in merge(pairs(keys, docs, bisect_left(keys, prefix)),
+                              delta[bisect_left(delta, (prefix,)):]):
+            if not key.startswith(prefix):
+                return
+            yield doc
+
+    def autocomplete(self, query, limit=15):
+        """
+        Returns up to limit breweries whose name starts with query, in
+        alphabetical order, followed if there is room by those with a
+        later word of the name or a word of the city starting with it.
+        """
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        rv = []
+        seen = set()
+        for doc in chain(
+                self._prefix_docs(self._name_keys, self._name_docs,
+                                   self._name_delta, prefix),
+                self._prefix_docs(self._word_keys, self._word_docs,
+                                   self._word_delta, prefix)):
+            if doc not in seen and self._breweries[doc] is not None:
+                seen.add(doc)
+                rv.append(self._breweries[doc])
+                if len(rv) == limit:
+                    break
+        return rv
+
+    def search(self, query, limit=50, min_score=0.5):
+        """
+        Returns up to limit breweries sharing at least min_score of the
+        trigrams of query with their name and city, best matches first
+        and shorter names first among equal matches. Stale documents
+        can leave fewer than limit results when nearly all the best
+        scoring ones have been replaced or removed.
+        """
+        query_grams = trigrams(normalize(query))
+        grams = [self._grams[gram] for gram in query_grams
+                 if gram in self._grams]
+        if not grams:
+            return []
+        postings = np.concatenate([np.frombuffer(docs, dtype=np.uint32)
+                                   for docs in grams], dtype=np.intp)
+        scores = np.bincount(postings, minlength=len(self._breweries))
+        candidates = np.flatnonzero(
+            scores >= math.ceil(min_score * len(query_grams)))
+        candidate_scores = scores[candidates]
+        if len(candidates) > limit:
+            # Keep every candidate scoring at least the limit-th best
+            # score, so ties are ranked by name length below.
+            kth = np.partition(candidate_scores, -limit)[-limit]
+            best = candidate_scores >= kth
+            candidates = candidates[best]
+            candidate_scores = candidate_scores[best]
+        lengths = np.frombuffer(self._name_lengths, dtype=np.uint16)
+        order = np.lexsort((lengths[candidates], -candidate_scores))
+        rv = []
+        for doc in candidates[order].tolist():
+            brewery = self._breweries[doc]
+            if brewery is not None:
+                rv.append(brewery)
+                if len(rv) == limit:
+                    break
+        return rv
@@ -0,0 +1,178 @@
+# Author: Barrett Duna
+
+"""
+Local snapshot of the Open Brewery Database for offline querying. A
+BrewerySnapshot copies every brewery into an SQLite file once, keeps it up to
+date by fetching only the breweries updated since the last sync, and answers
+the BreweryQuery by_* queries from indexes in the file:
+
+    snapshot = BrewerySnapshot('breweries.sqlite')
+    snapshot.sync(BreweryQuery())
+    brew_query = BreweryQuery(backend=snapshot)
+    sf_breweries = brew_query.by_city('San Francisco')
+"""
+
+import json
+import sqlite3
+import threading
+
+from openbrewapi import Brewery, BreweryAPI, json_loads
+
+
+_encode = BreweryAPI()._encode_val_for_api_url
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS breweries (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    name_key TEXT,
+    city_key TEXT,
+    state_key TEXT,
+    postal_key TEXT,
+    type_key TEXT,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS tags (
+    tag_key TEXT NOT NULL,
+    id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS breweries_city ON breweries (city_key);
+CREATE INDEX IF NOT EXISTS breweries_state ON breweries (state_key);
+CREATE INDEX IF NOT EXISTS breweries_postal ON breweries (postal_key);
+CREATE INDEX IF NOT EXISTS breweries_type ON breweries (type_key);
+CREATE INDEX IF NOT EXISTS breweries_updated_at ON breweries (updated_at);
+CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag_key);
+CREATE INDEX IF NOT EXISTS tags_id ON tags (id);
+'''
+
+# The WHERE clause answering each by_* query on the encoded value, which
+# matches the API: names match anywhere, postal codes match on a prefix so
+# '94104' finds '94104-1234', everything else matches exactly.
+WHERE = {
+    'by_city': 'city_key = ?',
+    'by_name': 'instr(name_key, ?) > 0',
+    'by_state': 'state_key = ?',
+    'by_postal': 'postal_key >= ? AND postal_key < ?',
+    'by_type': 'type_key = ?',
+    'by_tag': 'id IN (SELECT id FROM tags WHERE tag_key = ?)',
+}
+
+
+def _key(val):
+    return _encode(str(val)) if val is not None else None
+
+
+class BrewerySnapshot:
+    """
+    A copy of the brewery database in the SQLite file at path (in memory
+    by default), indexed on city, state, postal code, type and tag. Each
+    brewery is stored as its JSON dictionary next to the encoded values
+    it is looked up by.
+
+    sync(query) replaces the snapshot with every brewery the
+    BreweryQuery query can list, and refresh(query) fetches only the
+    breweries updated since the newest updated_at in the snapshot. Pass
+    the snapshot as the backend of a BreweryQuery to answer its by_*
+    queries and get_brewery_by_id from it.
+    """
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM breweries') \
+                           .fetchone()[0]
+
+    def _rows(self, breweries):
+        rows = []
+        tags = []
+        for brewery in breweries:
+            brew_dict = brewery.brew_dict
+            id = str(brew_dict['id'])
+            rows.append((id, json.dumps(brew_dict), _key(brew_dict['name']),
+                         _key(brew_dict['city']), _key(brew_dict['state']),
+                         _key(brew_dict['postal_code']),
+                         _key(brew_dict['brewery_type']),
+                         brew_dict['updated_at']))
+            tags.extend((_key(tag), id) for tag in brew_dict['tag_list'] or ())
+        return rows, tags
+
+    def _upsert(self, rows, tags):
+        self._db.executemany('DELETE FROM tags WHERE id = ?',
+                             [(row[0],) for row in rows])
+        self._db.executemany('INSERT OR REPLACE INTO breweries '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self._db.executemany('INSERT INTO tags VALUES (?, ?)', tags)
+        return len(rows)
+
+    def add(self, breweries):
+        """
+        Adds or replaces breweries in the snapshot and returns how many
+        there were.
+        """
+        rows, tags = self._rows(breweries)
+        with self._lock, self._db:
+            return self._upsert(rows, tags)
+
+    def sync(self, query):
+        """
+        Replaces the snapshot with every brewery listed by query and
+        returns their number. The snapshot keeps answering queries from
+        its old contents during the crawl, which are then swapped for the
+        new ones in one transaction.
+        """
+        rows, tags = self._rows(query.iter_all())
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM breweries')
+            self._db.execute('DELETE FROM tags')
+            return self._upsert(rows, tags)
+
+    def refresh(self, query):
+        """
+        Fetches the breweries updated since the newest one in the
+        snapshot, most recent first, stopping at the first brewery that
+        is not newer, and returns how many were added or replaced.
+        """
+        with self._lock:
+            since = self._db.execute('SELECT MAX(updated_at) FROM breweries') \
+                            .fetchone()[0]
+        if since is None:
+            return self.sync(query)
+        updated = []
+        for brewery in query.iter_all(sort='-updated_at'):
+            if brewery.updated_at <= since:
+                break
+            updated.append(brewery)
+        return self.add(updated)
+
+    def query(self, key, val):
+        """
+        Returns the breweries matching the by_* query key for the value
+        val, encoded as BreweryQuery encodes it for the API.
+        """
+        if key == 'by_postal':
+            params = (val, val + '\uffff')
+        else:
+            params = (val,)
+        sql = 'SELECT data FROM breweries WHERE {} ORDER BY rowid' \
+              .format(WHERE[key])
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        brew_dicts = json_loads('[' + ','.join(data for data, in rows) + ']')
+        return [Brewery(brew_dict) for brew_dict in brew_dicts]
+
+    def get(self, id):
+        """
+        Returns the brewery with the given id, or None if there is none.
+        """
+        with self._lock:
+            row = self._db.execute('SELECT data FROM breweries WHERE id = ?',
+                                   (str(id),)).fetchone()
+        return Brewery(json_loads(row[0])) if row is not None else None
+
+    def close(self):
+        self._db.close()
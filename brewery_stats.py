@@ -0,0 +1,169 @@
+# Author: Barrett Duna
+
+"""
+Instrumentation for BreweryQuery in openbrewapi.py. A query given an
+instrument reports a StatsEvent for every request, JSON decode, batch of
+Brewery records built, page and public call, and QueryStats collects them
+into latency histograms and byte, page and cache counters, so it can be seen
+whether the time goes to the network, to parsing or to building records:
+
+    stats = QueryStats()
+    brew_query = BreweryQuery(instrument=stats)
+    brew_query.by_state('california')
+    print(stats.report())
+
+Any other callable taking a StatsEvent can be used as the instrument, or
+passed to QueryStats as a callback, to export the events elsewhere.
+"""
+
+import math
+import threading
+from collections import Counter, namedtuple
+
+
+# name is the event: 'request' for one response body, from the network or
+# the response cache, 'decode' for one json_loads, 'build' for one batch of
+# Brewery records, 'page' for one by_* result page from request to records,
+# and the method name ('by_city', 'search', 'get_brewery_by_id', ...) for a
+# whole call. cache is 'hit', 'revalidated' or 'miss' for requests made with
+# a response cache, and None otherwise.
+StatsEvent = namedtuple('StatsEvent',
+                        ['name', 'elapsed', 'nbytes', 'pages', 'cache'])
+LatencySummary = namedtuple('LatencySummary',
+                            ['count', 'total', 'mean', 'p50', 'p90', 'p99',
+                             'max'])
+
+
+class LatencyHistogram:
+    """
+    Counts durations in logarithmic buckets, BUCKETS_PER_OCTAVE to each
+    doubling, from one microsecond up, so percentiles are known to within
+    about 9% in constant memory however many durations are added.
+    """
+
+    BUCKETS_PER_OCTAVE = 8
+    RESOLUTION = 1e-6
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def _bucket(self, elapsed):
+        if elapsed <= self.RESOLUTION:
+            return 0
+        return int(math.log2(elapsed / self.RESOLUTION)
+                   * self.BUCKETS_PER_OCTAVE) + 1
+
+    def _upper_bound(self, bucket):
+        return self.RESOLUTION * 2 ** (bucket / self.BUCKETS_PER_OCTAVE)
+
+    def add(self, elapsed):
+        self.buckets[self._bucket(elapsed)] += 1
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+    def percentile(self, q):
+        """
+        Returns the upper bound of the bucket holding the q-th percentile
+        duration, no more than the largest duration added, or 0.0 when
+        the histogram is empty.
+        """
+        if not self.count:
+            return 0.0
+        rank = math.ceil(q / 100 * self.count)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self._upper_bound(bucket), self.max)
+        return self.max
+
+    def summary(self):
+        mean = self.total / self.count if self.count else 0.0
+        return LatencySummary(self.count, self.total, mean,
+                              self.percentile(50), self.percentile(90),
+                              self.percentile(99), self.max)
+
+
+class QueryStats:
+    """
+    Collects the StatsEvents of one or more BreweryQuery objects: a
+    LatencyHistogram per event name, the bytes received and decoded, the
+    pages fetched and the response cache outcomes of the requests. Each
+    event is also passed to every function in callbacks. The stats are
+    safe to share between threads and queries.
+    """
+
+    def __init__(self, callbacks=()):
+        self.callbacks = list(callbacks)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._bytes = Counter()
+            self._pages = 0
+            self._cache = Counter()
+
+    def __call__(self, event):
+        with self._lock:
+            histogram = self._histograms.get(event.name)
+            if histogram is None:
+                histogram = self._histograms[event.name] = LatencyHistogram()
+            histogram.add(event.elapsed)
+            if event.nbytes:
+                self._bytes[event.name] += event.nbytes
+            if event.name == 'page':
+                self._pages += 1
+            if event.cache is not None:
+                self._cache[event.cache] += 1
+        for callback in self.callbacks:
+            callback(event)
+
+    def latency(self):
+        """
+        Returns a LatencySummary for every event name seen so far.
+        """
+        with self._lock:
+            return {name: histogram.summary()
+                    for name, histogram in self._histograms.items()}
+
+    def bytes_transferred(self):
+        """
+        Returns the bytes of response bodies received, including those
+        answered by the response cache, by event name.
+        """
+        with self._lock:
+            return dict(self._bytes)
+
+    def pages(self):
+        with self._lock:
+            return self._pages
+
+    def cache_outcomes(self):
+        with self._lock:
+            return dict(self._cache)
+
+    def report(self):
+        """
+        Returns a table of the latency of every event name, with the
+        byte, page and cache counters below it.
+        """
+        lines = ['{:<20} {:>7} {:>10} {:>10} {:>10} {:>10}'.format(
+            'event', 'count', 'total ms', 'p50 ms', 'p99 ms', 'max ms')]
+        for name, summary in sorted(self.latency().items()):
+            lines.append('{:<20} {:>7} {:>10.2f} {:>10.3f} {:>10.3f} '
+                         '{:>10.3f}'.format(name, summary.count,
+                                            summary.total * 1000,
+                                            summary.p50 * 1000,
+                                            summary.p99 * 1000,
+                                            summary.max * 1000))
+        lines.append('bytes: {}'.format(self.bytes_transferred()))
+        lines.append('pages: {}'.format(self.pages()))
+        lines.append('cache: {}'.format(self.cache_outcomes()))
+        return '\n'.join(lines)
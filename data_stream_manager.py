@@ -1,6 +1,160 @@
 # Author: Barrett Duna
 
+import asyncio
+import itertools
+import multiprocessing
+import threading
+import time
 from abc import ABC, abstractmethod
+from collections import deque, namedtuple
+from concurrent.futures import (ALL_COMPLETED, FIRST_COMPLETED,
+								ProcessPoolExecutor, ThreadPoolExecutor, wait)
+
+
+DispatchError = namedtuple('DispatchError', ['subscriber', 'error'])
+QueueStats = namedtuple('QueueStats', ['depth', 'max_depth', 'enqueued',
+									   'processed', 'dropped', 'errors'])
+
+
+class SubscriberQueue:
+	"""
+	A bounded queue of up to maxsize items for one subscriber, with a
+	worker thread passing them to its process method in order. When an
+	item arrives at a full queue, overflow decides what happens:
+
+	- 'block' makes the producer wait until the worker frees a slot;
+	- 'drop_oldest' discards the oldest queued item to make room;
+	- 'drop_newest' discards the arriving item;
+	- 'sample' keeps one in every sample_every arriving items, making
+	  room for it by discarding the oldest, and discards the others, so
+	  a long burst leaves an evenly thinned sample of itself queued.
+
+	Exceptions raised by the subscriber are passed to on_error along
+	with it, and the worker goes on with the next item.
+	"""
+
+	OVERFLOW_POLICIES = ('block', 'drop_oldest', 'drop_newest', 'sample')
+
+	def __init__(self, subscriber, maxsize=1024, overflow='block',
+				 sample_every=10, on_error=None):
+		if overflow not in self.OVERFLOW_POLICIES:
+			raise ValueError("Unknown overflow policy {!r}.".format(overflow))
+		if maxsize < 1:
+			raise ValueError("A subscriber queue needs room for an item.")
+		self.subscriber = subscriber
+		self.maxsize = maxsize
+		self.overflow = overflow
+		self.sample_every = sample_every
+		self.on_error = on_error
+		self._items = deque()
+		self._lock = threading.Lock()
+		self._not_empty = threading.Condition(self._lock)
+		self._not_full = threading.Condition(self._lock)
+		self._all_done = threading.Condition(self._lock)
+		self._closing = False
+		self._unfinished = 0
+		self._overflowed = 0
+		self._max_depth = 0
+		self._enqueued = 0
+		self._processed = 0
+		self._dropped = 0
+		self._errors = 0
+		self._worker = threading.Thread(target=self._work, daemon=True)
+		self._worker.start()
+
+	def put(self, item):
+		"""
+		Queues item and returns whether it was kept. An item dropped
+		by the overflow policy, or because the queue was closed while
+		waiting for room with 'block', counts as dropped.
+		"""
+		with self._lock:
+			if self._closing:
+				raise ValueError("Cannot put items on a closed queue.")
+			if len(self._items) >= self.maxsize:
+				if self.overflow == 'block':
+					while len(self._items) >= self.maxsize \
+							and not self._closing:
+						self._not_full.wait()
+					if self._closing:
+						self._dropped += 1
+						return False
+				elif self.overflow == 'drop_newest':
+					self._dropped += 1
+					return False
+				else:
+					self._overflowed += 1
+					self._dropped += 1
+					if self.overflow == 'sample' \
+							and self._overflowed % self.sample_every:
+						return False
+					self._items.popleft()
+					self._unfinished -= 1
+			self._items.append(item)
+			self._unfinished += 1
+			self._enqueued += 1
+			self._max_depth = max(self._max_depth, len(self._items))
+			self._not_empty.notify()
+			return True
+
+	def _work(self):
+		while True:
+			with self._lock:
+				while not self._items and not self._closing:
+					self._not_empty.wait()
+				if not self._items:
+					return
+				item = self._items.popleft()
+				self._not_full.notify()
+			try:
+				self.subscriber.process(item)
+				failed = False
+			except Exception as e:
+				failed = True
+				if self.on_error is not None:
+					self.on_error(self.subscriber, e)
+			with self._lock:
+				self._processed += 1
+				self._errors += failed
+				self._unfinished -= 1
+				if not self._unfinished:
+					self._all_done.notify_all()
+
+	def join(self, timeout=None):
+		"""
+		Waits until every queued item has been processed and returns
+		whether they all were before the timeout.
+		"""
+		with self._lock:
+			return self._all_done.wait_for(lambda: not self._unfinished,
+										   timeout)
+
+	def close(self, drain=True):
+		"""
+		Stops the worker once it has processed the queued items, or
+		after the item in hand when drain is False, counting the rest
+		as dropped.
+		"""
+		with self._lock:
+			self._closing = True
+			if not drain:
+				self._dropped += len(self._items)
+				self._unfinished -= len(self._items)
+				self._items.clear()
+			self._not_empty.notify_all()
+			self._not_full.notify_all()
+		self._worker.join()
+
+	def stats(self):
+		"""
+		Returns a QueueStats with the current and largest number of
+		items queued, how many were queued, processed and dropped and
+		how many raised an exception.
+		"""
+		with self._lock:
+			return QueueStats(len(self._items), self._max_depth,
+							  self._enqueued, self._processed, self._dropped,
+							  self._errors)
 
 
 class DataStreamManager:
@@ -18,25 +172,293 @@ class DataStreamManager:
 	This code architecture can be used in applications that
 	have many different components needing access to the same
 	data stream.
+
+	dispatch selects how process hands the data to the subscribers:
+
+	- 'serial' calls them one after another on the caller's thread;
+	- 'thread' calls them all at once on a pool of max_workers threads,
+	  for subscribers that wait on I/O;
+	- 'process' calls them all at once on a pool of max_workers
+	  processes, for CPU-bound subscribers. Each subscriber is pickled
+	  to a worker process with every item, so changes it makes to its
+	  own state there are not seen by the caller;
+	- 'asyncio' awaits subscribers whose process is a coroutine
+	  function together on an event loop, and runs the others on a
+	  thread pool meanwhile. Call process from synchronous code, or
+	  await aprocess from a running event loop;
+	- 'queue' gives every subscriber a SubscriberQueue of queue_size
+	  items with its own worker thread, so process only queues the data
+	  and returns. When a queue is full, the overflow policy ('block',
+	  'drop_oldest', 'drop_newest' or 'sample') either holds the
+	  producer back or drops items. Subscribers can be given their own
+	  queue_size and overflow when they subscribe. queue_stats() reports
+	  the depth and drops of every queue, and join() waits for the
+	  queues to empty.
+
+	Coroutine subscribers can only subscribe with the 'asyncio'
+	dispatch. The 'serial' dispatch lets an exception raised by a
+	subscriber propagate to the caller, as it always has, and the
+	subscribers after it do not get the data. In the other modes process
+	waits for all the subscribers and returns a DispatchError for each
+	one that raised an exception, without stopping the others. A
+	subscriber taking longer than its
+	timeout, given when it subscribes or timeout by default, is
+	reported with a TimeoutError and left to finish in the background.
+	The timeout counts from when the subscriber starts running, so time
+	spent waiting for a free worker when there are more subscribers than
+	max_workers is not included, and subscribers still waiting are never
+	cancelled.
+	Timeouts cannot be enforced with the 'serial' and 'queue'
+	dispatches. With the 'queue' dispatch the subscribers run after
+	process has returned, so each call returns the errors raised since
+	the previous one.
+
+	Call close(), or use the manager as a context manager, to shut the
+	pools down.
 	"""
-	def __init__(self):
+
+	DISPATCH_MODES = ('serial', 'thread', 'process', 'asyncio', 'queue')
+	START_POLL = 0.005
+
+	def __init__(self, dispatch='serial', max_workers=None, timeout=None,
+				 queue_size=1024, overflow='block', sample_every=10):
+		if dispatch not in self.DISPATCH_MODES:
+			raise ValueError("Unknown dispatch mode {!r}.".format(dispatch))
+		if overflow not in SubscriberQueue.OVERFLOW_POLICIES:
+			raise ValueError("Unknown overflow policy {!r}.".format(overflow))
 		self.subscribers = []
+		self.timeouts = {}
+		self.dispatch = dispatch
+		self.max_workers = max_workers
+		self.timeout = timeout
+		self.queue_size = queue_size
+		self.overflow = overflow
+		self.sample_every = sample_every
+		self.queues = {}
+		self._errors = deque()
+		self._executor = None
+		self._starts = None
+		self._keys = itertools.count()
+		self._loop = None
 
-	def subscribe(self, subscriber):
+	def subscribe(self, subscriber, timeout=None, queue_size=None,
+				  overflow=None):
 		if subscriber in self.subscribers:
 			raise ValueError("Multiple subscriptions not allowed.")
 		if not issubclass(type(subscriber), DataStreamUser):
 			raise ValueError("Input is not a valid type of subscriber.")
+		if asyncio.iscoroutinefunction(subscriber.process) \
+				and self.dispatch != 'asyncio':
+			raise ValueError("Coroutine subscribers need the asyncio dispatch.")
+		if self.dispatch == 'queue':
+			self.queues[subscriber] = SubscriberQueue(
+				subscriber, queue_size or self.queue_size,
+				overflow or self.overflow, self.sample_every,
+				self._queue_error)
 		self.subscribers.append(subscriber)
+		if timeout is not None:
+			self.timeouts[subscriber] = timeout
 
 	def unsubscribe(self, subscriber):
 		if subscriber not in self.subscribers:
 			raise ValueError("Can only unsubscribe subscribers.")
 		self.subscribers.remove(subscriber)
+		self.timeouts.pop(subscriber, None)
+		queue = self.queues.pop(subscriber, None)
+		if queue is not None:
+			queue.close()
+
+	def close(self, drain=True):
+		"""
+		Shuts the pools down and stops the queue workers, after they
+		have processed the items queued unless drain is False.
+		"""
+		for queue in self.queues.values():
+			queue.close(drain)
+		if self._executor is not None:
+			self._executor.shutdown(wait=True)
+			self._executor = None
+		if self._loop is not None:
+			self._loop.close()
+			self._loop = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	def _get_executor(self):
+		if self._executor is None:
+			if self.dispatch == 'process':
+				# The workers report on this queue when they start a call,
+				# as the pool marks more calls running than it has workers.
+				self._starts = multiprocessing.SimpleQueue()
+				self._executor = ProcessPoolExecutor(
+					self.max_workers, initializer=_set_start_queue,
+					initargs=(self._starts,))
+			else:
+				self._executor = ThreadPoolExecutor(self.max_workers)
+		return self._executor
+
+	def _timeout(self, subscriber):
+		return self.timeouts.get(subscriber, self.timeout)
+
+	def _timeout_error(self, subscriber):
+		return TimeoutError("Subscriber did not finish within {}s."
+							.format(self._timeout(subscriber)))
 
 	def process(self, data):
-		for subscriber in self.subscribers:
+		"""
+		Passes data to every subscriber and returns a list of
+		DispatchError for those that failed or timed out, which is
+		always empty with the 'serial' dispatch.
+		"""
+		if self.dispatch == 'serial':
+			return self._process_serial(data)
+		if self.dispatch == 'queue':
+			for subscriber in list(self.subscribers):
+				self.queues[subscriber].put(data)
+			return self._queued_errors()
+		if self.dispatch == 'asyncio':
+			if self._loop is None:
+				self._loop = asyncio.new_event_loop()
+			return self._loop.run_until_complete(self.aprocess(data))
+		return self._process_pool(data)
+
+	def _process_serial(self, data):
+		for subscriber in list(self.subscribers):
 			subscriber.process(data)
+		return []
+
+	def _process_pool(self, data):
+		executor = self._get_executor()
+		started = {}
+		report = _report_start if self.dispatch == 'process' \
+			else started.__setitem__
+		futures = []
+		for subscriber in self.subscribers:
+			key = next(self._keys)
+			futures.append((subscriber, key, executor.submit(
+				_call_started, report, key, subscriber.process, data)))
+		pending = {future for _, _, future in futures}
+		timed_out = set()
+		while pending:
+			if self._starts is not None:
+				while not self._starts.empty():
+					key, start = self._starts.get()
+					started[key] = start
+			now = time.monotonic()
+			wake = None
+			for subscriber, key, future in futures:
+				timeout = self._timeout(subscriber)
+				if future not in pending or timeout is None:
+					continue
+				if key not in started:
+					# Still waiting for a worker, so look again shortly.
+					remaining = self.START_POLL
+				else:
+					remaining = started[key] + timeout - now
+					if remaining <= 0:
+						pending.discard(future)
+						timed_out.add(key)
+						continue
+				wake = remaining if wake is None else min(wake, remaining)
+			if pending:
+				_, pending = wait(pending, wake, FIRST_COMPLETED
+								  if wake is not None else ALL_COMPLETED)
+		errors = []
+		for subscriber, key, future in futures:
+			if key in timed_out:
+				errors.append(DispatchError(subscriber,
+											self._timeout_error(subscriber)))
+			elif future.exception() is not None:
+				errors.append(DispatchError(subscriber, future.exception()))
+		return errors
+
+	def _queue_error(self, subscriber, error):
+		self._errors.append(DispatchError(subscriber, error))
+
+	def _queued_errors(self):
+		errors = []
+		while self._errors:
+			errors.append(self._errors.popleft())
+		return errors
+
+	def queue_stats(self):
+		"""
+		Returns the QueueStats of every subscriber's queue with the
+		'queue' dispatch, keyed by subscriber.
+		"""
+		return {subscriber: queue.stats()
+				for subscriber, queue in self.queues.items()}
+
+	def join(self, timeout=None):
+		"""
+		Waits until every subscriber's queue has been processed, for up
+		to timeout seconds in all, and returns the errors raised since
+		the last call to process.
+		"""
+		deadline = None if timeout is None else time.monotonic() + timeout
+		for queue in list(self.queues.values()):
+			remaining = None if deadline is None \
+				else max(0, deadline - time.monotonic())
+			queue.join(remaining)
+		return self._queued_errors()
+
+	async def aprocess(self, data):
+		"""
+		Passes data to every subscriber from the running event loop and
+		returns a list of DispatchError for those that failed or timed
+		out. Coroutine subscribers are awaited and the others run on
+		the thread pool, all at once.
+		"""
+		subscribers = list(self.subscribers)
+		results = await asyncio.gather(
+			*(self._aprocess_one(subscriber, data)
+			  for subscriber in subscribers),
+			return_exceptions=True)
+		return [DispatchError(subscriber, error)
+				for subscriber, error in zip(subscribers, results)
+				if isinstance(error, BaseException)]
+
+	async def _aprocess_one(self, subscriber, data):
+		if asyncio.iscoroutinefunction(subscriber.process):
+			call = subscriber.process(data)
+		else:
+			loop = asyncio.get_running_loop()
+			started = loop.create_future()
+
+			def report(key, start):
+				loop.call_soon_threadsafe(started.set_result, start)
+
+			call = loop.run_in_executor(self._get_executor(), _call_started,
+										report, None, subscriber.process,
+										data)
+			await started
+		try:
+			await asyncio.wait_for(call, self._timeout(subscriber))
+		except asyncio.TimeoutError:
+			raise self._timeout_error(subscriber) from None
+
+
+_start_queue = None
+
+
+def _set_start_queue(queue):
+	global _start_queue
+	_start_queue = queue
+
+
+def _report_start(key, start):
+	_start_queue.put((key, start))
+
+
+def _call_started(report, key, process, data):
+	# Runs on a worker and reports when the call starts, which is when
+	# the subscriber's timeout starts counting.
+	report(key, time.monotonic())
+	return process(data)
 
 
 class DataStreamUser(ABC):
@@ -50,12 +472,20 @@ class DataStreamUser(ABC):
 	def __init__(self, dsm):
 		self.dsm = dsm
 
-	def subscribe(self):
-		self.dsm.subscribe(self)
+	def subscribe(self, timeout=None, queue_size=None, overflow=None):
+		self.dsm.subscribe(self, timeout, queue_size, overflow)
 
 	def unsubscribe(self):
 		self.dsm.unsubscribe(self)
 
+	def __getstate__(self):
+		# The manager holds the pools and cannot be pickled, so it is
+		# left behind when the 'process' dispatch sends a subscriber to
+		# a worker process.
+		state = self.__dict__.copy()
+		state['dsm'] = None
+		return state
+
 	@abstractmethod
 	def process(self, data):
 		pass
@@ -0,0 +1,214 @@
+# Author: Barrett Duna
+
+"""
+Benchmarks for the dispatch modes of DataStreamManager in
+data_stream_manager.py, measuring how many items per second reach 1, 10 and
+100 subscribers that wait on I/O, that compute, and that are coroutines, and
+how long a burst of items keeps the producer waiting with bounded queues.
+
+Run the module directly to print every benchmark:
+
+	python data_stream_manager_benchmarks.py
+"""
+
+import asyncio
+import os
+import time
+
+from data_stream_manager import (DataStreamManager, DataStreamUser,
+								 DispatchError, SubscriberQueue)
+
+
+class SleepingUser(DataStreamUser):
+	"""
+	Stands for a subscriber waiting on I/O, such as a write to a
+	socket, for delay seconds per item.
+	"""
+	def __init__(self, dsm, delay=0.001):
+		super().__init__(dsm)
+		self.delay = delay
+
+	def process(self, data):
+		time.sleep(self.delay)
+
+
+class ComputingUser(DataStreamUser):
+	"""
+	Stands for a CPU-bound subscriber, summing the squares of the first
+	work integers per item.
+	"""
+	def __init__(self, dsm, work=20000):
+		super().__init__(dsm)
+		self.work = work
+
+	def process(self, data):
+		return sum(i * i for i in range(self.work))
+
+
+class AsyncSleepingUser(DataStreamUser):
+	"""
+	A coroutine subscriber waiting on I/O for delay seconds per item.
+	"""
+	def __init__(self, dsm, delay=0.001):
+		super().__init__(dsm)
+		self.delay = delay
+
+	async def process(self, data):
+		await asyncio.sleep(self.delay)
+
+
+class RecordingUser(DataStreamUser):
+
+	def __init__(self, dsm):
+		super().__init__(dsm)
+		self.received = []
+
+	def process(self, data):
+		self.received.append(data)
+
+
+class FailingUser(DataStreamUser):
+
+	def process(self, data):
+		raise RuntimeError("Subscriber failed on {!r}.".format(data))
+
+
+def _throughput(dsm, user_class, subscribers, items):
+	for _ in range(subscribers):
+		user_class(dsm).subscribe()
+	dsm.process(-1)
+	start = time.perf_counter()
+	for item in range(items):
+		errors = dsm.process(item)
+		assert not errors, errors
+	return items / (time.perf_counter() - start)
+
+
+def _report(name, counts, rates):
+	print('{:<36}'.format(name)
+		  + ''.join('  {:>4} subs {:>8.1f}/s'.format(count, rate)
+					for count, rate in zip(counts, rates)))
+
+
+def benchmark_dispatch(counts=(1, 10, 100), items=20):
+	"""
+	Prints the items per second processed by every dispatch mode with
+	1, 10 and 100 subscribers of each kind. The thread pools get one
+	thread per subscriber and the process pool one process per CPU.
+	"""
+	cpus = os.cpu_count() or 1
+	cases = (
+		('I/O', SleepingUser, (('serial', None), ('thread', 'subscribers'),
+							   ('asyncio', 'subscribers'))),
+		('CPU', ComputingUser, (('serial', None), ('thread', 'subscribers'),
+								('process', cpus))),
+		('coroutine', AsyncSleepingUser, (('asyncio', None),)),
+	)
+	for kind, user_class, modes in cases:
+		for dispatch, max_workers in modes:
+			rates = []
+			for count in counts:
+				workers = count if max_workers == 'subscribers' \
+					else max_workers
+				with DataStreamManager(dispatch, workers) as dsm:
+					rates.append(_throughput(dsm, user_class, count, items))
+			_report('{} subscribers, {}'.format(kind, dispatch), counts,
+					rates)
+
+
+def benchmark_isolation(timeout=0.05):
+	"""
+	Checks in every dispatch mode that a failing subscriber and, where
+	timeouts are enforced, one slower than its timeout are reported
+	without keeping the data from the others, except that the 'serial'
+	dispatch raises the error, and prints how long process took, or
+	process and join with the 'queue' dispatch. Then checks with two
+	workers that two slow subscribers do not use up the timeout of a
+	fast one waiting for a worker behind them.
+	"""
+	for dispatch in DataStreamManager.DISPATCH_MODES:
+		with DataStreamManager(dispatch) as dsm:
+			enforced = dispatch not in ('serial', 'queue')
+			SleepingUser(dsm).subscribe()
+			FailingUser(dsm).subscribe()
+			if enforced:
+				SleepingUser(dsm, delay=timeout * 4).subscribe(timeout)
+			ComputingUser(dsm).subscribe()
+			start = time.perf_counter()
+			if dispatch == 'serial':
+				try:
+					dsm.process('item')
+				except RuntimeError as e:
+					errors = [DispatchError(None, e)]
+			else:
+				errors = dsm.process('item')
+			if dispatch == 'queue':
+				errors += dsm.join()
+			elapsed = time.perf_counter() - start
+			expected = [RuntimeError, TimeoutError] if enforced \
+				else [RuntimeError]
+			assert [type(error.error) for error in errors] == expected
+			print('{:<36} {} errors in {:.3f}s'.format(
+				'isolation, ' + dispatch, len(errors), elapsed))
+	for dispatch in ('thread', 'process', 'asyncio'):
+		with DataStreamManager(dispatch, max_workers=2,
+							   timeout=timeout) as dsm:
+			for _ in range(2):
+				SleepingUser(dsm, delay=timeout * 4).subscribe()
+			fast = RecordingUser(dsm)
+			fast.subscribe()
+			start = time.perf_counter()
+			errors = dsm.process('item')
+			elapsed = time.perf_counter() - start
+			assert [type(error.error) for error in errors] \
+				== [TimeoutError, TimeoutError], errors
+			assert dispatch == 'process' or fast.received == ['item']
+			print('{:<36} {} errors in {:.3f}s'.format(
+				'isolation, 2 workers, ' + dispatch, len(errors), elapsed))
+
+
+def _percentile(values, q):
+	values = sorted(values)
+	return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def benchmark_backpressure(burst=2000, queue_size=100, delay=0.0005):
+	"""
+	Sends a burst of items as fast as possible to one subscriber taking
+	delay seconds per item and a fast one, first with serial dispatch
+	and then through a queue of queue_size items under every overflow
+	policy. Prints the 99th percentile and largest time a process call
+	kept the producer waiting, and the QueueStats of the slow subscriber.
+	"""
+	policies = [('serial', None)] + [('queue', overflow) for overflow
+									 in SubscriberQueue.OVERFLOW_POLICIES]
+	for dispatch, overflow in policies:
+		with DataStreamManager(dispatch, queue_size=queue_size,
+							   overflow=overflow or 'block') as dsm:
+			slow = SleepingUser(dsm, delay)
+			slow.subscribe()
+			SleepingUser(dsm, 0).subscribe()
+			waits = []
+			start = time.perf_counter()
+			for item in range(burst):
+				call_start = time.perf_counter()
+				dsm.process(item)
+				waits.append(time.perf_counter() - call_start)
+			produced = time.perf_counter() - start
+			dsm.join()
+			drained = time.perf_counter() - start
+			stats = dsm.queue_stats().get(slow)
+		print('{:<36} burst {:>7.3f}s  drained {:>7.3f}s  wait p99 '
+			  '{:>8.3f}ms  max {:>8.3f}ms'.format(
+				  'backpressure, ' + (overflow or dispatch), produced,
+				  drained, _percentile(waits, 99) * 1000,
+				  max(waits) * 1000))
+		if stats is not None:
+			print('{:<36} {}'.format('', stats))
+
+
+if __name__ == '__main__':
+
+	benchmark_dispatch()
+	benchmark_isolation()
+	benchmark_backpressure()
@@ -10,26 +10,106 @@ Brewery class is also created to store the brewery data in.
 """
 
 import requests
+import functools
 import json
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import (FIRST_COMPLETED, Future, ThreadPoolExecutor,
+                                wait)
+from operator import itemgetter
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from brewery_cache import conditional_headers
+from brewery_stats import StatsEvent
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+BrewerySummary = namedtuple('BrewerySummary', ['id', 'name'])
+RateLimitInfo = namedtuple('RateLimitInfo',
+                           ['acquired', 'throttled', 'wait_time'])
+SingleFlightInfo = namedtuple('SingleFlightInfo', ['calls', 'coalesced'])
+BulkResult = namedtuple('BulkResult',
+                        ['key', 'val', 'breweries', 'elapsed', 'error'])
+
+
+def _field_property(i):
+    return property(lambda self: self._values[i])
+
+
+def instrumented(name=None):
+    """
+    Decorates a BreweryQuery method to report how long each call takes
+    to the instrument of the query, as an event called name, or the name
+    of the method by default.
+    """
+    def decorator(func):
+        event_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if self.instrument is None:
+                return func(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self._emit(event_name, start)
+        return wrapper
+    return decorator
+
 
 class Brewery:
+    """
+    A brewery record. The values of the FIELDS are kept in one tuple,
+    with any other keys of the API record in a small dictionary, instead
+    of copying them into instance attributes next to the dictionary they
+    came from. The fields are read from the tuple on access, and
+    brew_dict is rebuilt from it when asked for.
+    """
+
+    FIELDS = ('id', 'name', 'brewery_type', 'street', 'city', 'state',
+              'postal_code', 'country', 'longitude', 'latitude', 'phone',
+              'website_url', 'updated_at', 'tag_list')
+    _get_fields = itemgetter(*FIELDS)
+    _field_set = frozenset(FIELDS)
+
+    __slots__ = ('_values', '_extra')
+
+    id = _field_property(0)
+    name = _field_property(1)
+    brewery_type = _field_property(2)
+    street = _field_property(3)
+    city = _field_property(4)
+    state = _field_property(5)
+    postal_code = _field_property(6)
+    country = _field_property(7)
+    longitude = _field_property(8)
+    latitude = _field_property(9)
+    phone = _field_property(10)
+    website_url = _field_property(11)
+    updated_at = _field_property(12)
+    tag_list = _field_property(13)
 
     def __init__(self, brew_dict):
-        self.brew_dict = brew_dict
-        self.id = brew_dict['id']
-        self.name = brew_dict['name']
-        self.brewery_type = brew_dict['brewery_type']
-        self.street = brew_dict['street']
-        self.city = brew_dict['city']
-        self.state = brew_dict['state']
-        self.postal_code = brew_dict['postal_code']
-        self.country = brew_dict['country']
-        self.longitude = brew_dict['longitude']
-        self.latitude = brew_dict['latitude']
-        self.phone = brew_dict['phone']
-        self.website_url = brew_dict['website_url']
-        self.updated_at = brew_dict['updated_at']
-        self.tag_list = brew_dict['tag_list']
+        self._values = self._get_fields(brew_dict)
+        if len(brew_dict) == len(self.FIELDS):
+            self._extra = None
+        else:
+            self._extra = {key: val for key, val in brew_dict.items()
+                           if key not in self._field_set}
+
+    @property
+    def brew_dict(self):
+        brew_dict = dict(zip(self.FIELDS, self._values))
+        if self._extra:
+            brew_dict.update(self._extra)
+        return brew_dict
 
     def __str__(self):
         rstr = ''
@@ -38,107 +118,602 @@ class Brewery:
         return rstr
 
 
-def brew_key_decorator(func):
-    def wrapper(self, *args, **kwargs):
-        self.current_key = func.__name__
-        return func(self, *args, **kwargs)
-    return wrapper
-
-
-class BreweryQuery:
+class TokenBucket:
+    """
+    Limits requests to rate per second on average, allowing bursts of up
+    to capacity requests. One bucket can be shared by any number of
+    BreweryQuery objects and threads to keep all of them under an
+    upstream rate limit together.
+
+    acquire() takes a token, sleeping first if the bucket is empty.
+    Tokens are reserved under a lock and the sleeping is done outside
+    it, so waiting callers are served in the order they arrived.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self._acquired = 0
+        self._throttled = 0
+        self._wait_time = 0.0
+
+    def acquire(self):
+        """
+        Takes a token and returns the seconds spent waiting for it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self._acquired += 1
+            if wait > 0:
+                self._throttled += 1
+                self._wait_time += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def info(self):
+        """
+        Returns a RateLimitInfo with the number of tokens taken, how many
+        of them had to wait and the total seconds waited.
+        """
+        with self._lock:
+            return RateLimitInfo(self._acquired, self._throttled,
+                                 self._wait_time)
+
+
+class SingleFlight:
+    """
+    Coalesces identical calls that overlap in time. While func(*args) is
+    running for a key, every other do() with the same key waits for it
+    and gets its result, or its exception, instead of calling func
+    again. A call made after the first one has finished runs afresh.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._coalesced = 0
+
+    def do(self, key, func, *args):
+        with self._lock:
+            self._calls += 1
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+            else:
+                self._coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            future.set_result(func(*args))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return future.result()
+
+    def info(self):
+        """
+        Returns a SingleFlightInfo with the number of calls made and how
+        many of them shared the result of another.
+        """
+        with self._lock:
+            return SingleFlightInfo(self._calls, self._coalesced)
+
+
+class BreweryAPI:
+    """
+    The endpoints of the Open Brewery Database API, shared by the
+    blocking BreweryQuery and the asyncio AsyncBreweryQuery.
+    """
 
     RESULTS_PER_PAGE = 50
     base_api_url = 'https://api.openbrewerydb.org/breweries'
     results_per_page = '?per_page=' + str(RESULTS_PER_PAGE) + '&'
     equals = '='
 
-    @brew_key_decorator
+    def _encode_val_for_api_url(self, val):
+        return val.lower().replace(' ', '_')
+
+    def _assemble_api_url(self, key, val, page):
+        return self.base_api_url + self.results_per_page + key + self.equals \
+               + val + '&page=' + str(page)
+
+    def _id_api_url(self, id):
+        return self.base_api_url + '/' + str(id)
+
+    def _search_api_url(self, query):
+        return self.base_api_url + '/search?query' + self.equals \
+               + self._encode_val_for_api_url(query)
+
+    def _autocomplete_api_url(self, query):
+        return self.base_api_url + '/autocomplete?query' + self.equals \
+               + self._encode_val_for_api_url(query)
+
+
+class BreweryQuery(BreweryAPI):
+    """
+    Queries the Open Brewery Database API. All requests go through one
+    pooled requests.Session, so connections are kept alive and reused
+    across pages and calls. Failed requests (connection errors and 429,
+    500, 502, 503 and 504 responses) are retried with exponential
+    backoff, honoring any Retry-After header sent by the server.
+
+    The by_* queries fetch up to max_workers result pages at a time from
+    a thread pool, in order, and stop as soon as a short or empty page
+    shows the results are exhausted. max_workers=1 fetches one page at a
+    time.
+
+    Breweries fetched by id are kept in a least recently used cache of
+    up to cache_size entries, which autocomplete also uses to hydrate
+    its hits, fetching the missing ones concurrently.
+
+    cache, such as a brewery_cache.ResponseCache, caches response bodies
+    by URL and lets expired ones be revalidated with the ETag and
+    Last-Modified headers the server sent, so repeated queries skip the
+    network or at least the download.
+
+    backend, such as a brewery_snapshot.BrewerySnapshot, answers the by_*
+    queries and get_brewery_by_id locally instead of the API. It is
+    given the query key ('by_city', ...) and the value encoded as for
+    the API.
+
+    search_index, such as a brewery_search.SearchIndex, answers search
+    and autocomplete locally in the same way.
+
+    Identical by_* queries and requests made at the same time, for
+    instance by threads querying the same city, are coalesced into one
+    through single_flight, a SingleFlight that may be shared with other
+    queries; pass False to turn coalescing off. rate_limiter, a
+    TokenBucket usually shared by every query talking to the API, holds
+    requests back to its rate. Retries made by the session are not
+    counted against it.
+
+    Every method can be called from many threads at once. The state
+    they share (the session, the executor, the caches, the coalescing
+    and the rate limiter) is safe for concurrent use, and the query key
+    travels with each call, so one pooled BreweryQuery can serve a
+    whole thread pool.
+
+    instrument, such as a brewery_stats.QueryStats or any other callable,
+    is passed a brewery_stats.StatsEvent for every request, JSON decode,
+    batch of records built, page and call made through the query, giving
+    their duration along with the bytes received, the pages fetched and
+    the response cache outcome. No timing is done without one.
+
+    base_api_url can point the query at another server, such as a local
+    stub, and session replaces the pooled session entirely. Call close()
+    or use the query as a context manager to release its connections.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    QUERY_KEYS = ('by_city', 'by_name', 'by_state', 'by_postal', 'by_type',
+                  'by_tag')
+
+    def __init__(self, base_api_url=None, session=None, pool_size=10,
+                 timeout=(3.05, 27), max_retries=3, backoff_factor=0.5,
+                 max_workers=4, cache_size=1024, cache=None, backend=None,
+                 search_index=None, single_flight=True, rate_limiter=None,
+                 instrument=None):
+        if base_api_url is not None:
+            self.base_api_url = base_api_url
+        self.timeout = timeout
+        self.max_workers = max(1, max_workers)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self.cache_size = cache_size
+        self._by_id = OrderedDict()
+        self._by_id_lock = threading.Lock()
+        self.cache = cache
+        self.backend = backend
+        self.search_index = search_index
+        if single_flight is True:
+            single_flight = SingleFlight()
+        self.single_flight = single_flight or None
+        self.rate_limiter = rate_limiter
+        self.instrument = instrument
+        pool_size = max(pool_size, self.max_workers)
+        if session is None:
+            session = self._make_session(pool_size, max_retries,
+                                         backoff_factor)
+        self.session = session
+
+    def _make_session(self, pool_size, max_retries, backoff_factor):
+        retry = Retry(total=max_retries, backoff_factor=backoff_factor,
+                      status_forcelist=self.RETRY_STATUSES,
+                      allowed_methods=('GET',),
+                      respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def close(self):
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers)
+            return self._executor
+
+    def _cached_brewery(self, id):
+        with self._by_id_lock:
+            brewery = self._by_id.get(str(id))
+            if brewery is not None:
+                self._by_id.move_to_end(str(id))
+            return brewery
+
+    def _cache_brewery(self, brewery):
+        if self.cache_size <= 0:
+            return
+        with self._by_id_lock:
+            self._by_id[str(brewery.id)] = brewery
+            self._by_id.move_to_end(str(brewery.id))
+            if len(self._by_id) > self.cache_size:
+                self._by_id.popitem(last=False)
+
+    def _emit(self, name, start, nbytes=0, pages=0, cache=None):
+        self.instrument(StatsEvent(name, time.perf_counter() - start, nbytes,
+                                   pages, cache))
+
+    def _decode(self, source):
+        if self.instrument is None:
+            return json_loads(source)
+        start = time.perf_counter()
+        rv = json_loads(source)
+        self._emit('decode', start, nbytes=len(source))
+        return rv
+
+    def _build(self, brewery_dict_list):
+        if self.instrument is None:
+            return [Brewery(brewery_dict) for brewery_dict in brewery_dict_list]
+        start = time.perf_counter()
+        rv = [Brewery(brewery_dict) for brewery_dict in brewery_dict_list]
+        self._emit('build', start)
+        return rv
+
+    def _get(self, url):
+        """
+        Returns the body of the response to a GET request to url as
+        bytes, from the response cache when one is set and holds a fresh
+        copy, sharing the request with any identical one in flight.
+        """
+        if self.single_flight is None:
+            return self._fetch(url)
+        return self.single_flight.do(url, self._fetch, url)
+
+    def _session_get(self, url, headers=None):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        return self.session.get(url, timeout=self.timeout, headers=headers)
+
+    def _fetch(self, url):
+        if self.instrument is None:
+            return self._fetch_body(url)[0]
+        start = time.perf_counter()
+        body, cache = self._fetch_body(url)
+        self._emit('request', start, nbytes=len(body), cache=cache)
+        return body
+
+    def _fetch_body(self, url):
+        """
+        Returns the body of the response for url and how the response
+        cache answered it: 'hit', 'revalidated', 'miss', or None without
+        a cache.
+        """
+        if self.cache is None:
+            return self._session_get(url).content, None
+        entry, fresh = self.cache.lookup(url)
+        if fresh:
+            return entry.body, 'hit'
+        headers = conditional_headers(entry) if entry is not None else None
+        response = self._session_get(url, headers)
+        if response.status_code == 304 and entry is not None:
+            return self.cache.revalidated(url, entry).body, 'revalidated'
+        if response.status_code == 200:
+            self.cache.store(url, response.content,
+                             response.headers.get('ETag'),
+                             response.headers.get('Last-Modified'))
+        return response.content, 'miss'
+
     def by_city(self, city_name):
-        return self._query(self.current_key, city_name)
+        return self._query('by_city', city_name)
 
-    @brew_key_decorator
     def by_name(self, brewery_name):
-        return self._query(self.current_key, brewery_name)
+        return self._query('by_name', brewery_name)
 
-    @brew_key_decorator
     def by_state(self, state):
-        return self._query(self.current_key, state)
+        return self._query('by_state', state)
 
-    @brew_key_decorator
     def by_postal(self, postal_code):
-        return self._query(self.current_key, postal_code)
+        return self._query('by_postal', postal_code)
 
-    @brew_key_decorator
     def by_type(self, brewery_type):
-        return self._query(self.current_key, brewery_type)
+        return self._query('by_type', brewery_type)
 
-    @brew_key_decorator
     def by_tag(self, tag):
-        return self._query(self.current_key, tag)
+        return self._query('by_tag', tag)
+
+    def iter_by_city(self, city_name, prefetch=True):
+        """
+        Yields the breweries in city_name as each page of them arrives.
+        With prefetch the following pages are requested while the
+        current one is read; without it each page is requested only
+        once the previous one has been used up. Closing the generator,
+        or leaving a for loop over it early, requests no further pages.
+        Unlike by_city, no exception is raised when nothing matches.
+        """
+        return self._iter_query('by_city', city_name, prefetch)
+
+    def iter_by_name(self, brewery_name, prefetch=True):
+        return self._iter_query('by_name', brewery_name, prefetch)
+
+    def iter_by_state(self, state, prefetch=True):
+        return self._iter_query('by_state', state, prefetch)
+
+    def iter_by_postal(self, postal_code, prefetch=True):
+        return self._iter_query('by_postal', postal_code, prefetch)
+
+    def iter_by_type(self, brewery_type, prefetch=True):
+        return self._iter_query('by_type', brewery_type, prefetch)
 
+    def iter_by_tag(self, tag, prefetch=True):
+        return self._iter_query('by_tag', tag, prefetch)
+
+    @instrumented()
     def get_brewery_by_id(self, id):
-        api_url = self.base_api_url + '/' + str(id)
+        brewery = self._cached_brewery(id)
+        if brewery is not None:
+            return brewery
+        if self.backend is not None:
+            brewery = self.backend.get(id)
+            if brewery is None:
+                raise ValueError('No brewery has id {}.'.format(id))
+            return brewery
+        api_url = self._id_api_url(id)
         try:
-            source = requests.get(api_url).text
-            brew_dict = json.loads(source)
+            source = self._get(api_url)
+            brew_dict = self._decode(source)
             if 'message' in brew_dict:
                 raise ValueError('No brewery has id {}.'.format(id))
             else:
-                return Brewery(brew_dict)
+                brewery = self._build([brew_dict])[0]
+                self._cache_brewery(brewery)
+                return brewery
         except requests.exceptions.RequestException as e:
             SystemExit(e)
 
+    @instrumented()
     def search(self, query):
-        query = self._encode_val_for_api_url(query)
-        api_url = self.base_api_url + '/search?query' +self.equals + query
+        if self.search_index is not None:
+            return self.search_index.search(query)
+        api_url = self._search_api_url(query)
         try:
-            source = requests.get(api_url).text
-            brewery_dict_list = json.loads(source)
-            return [Brewery(brewery_dict) for brewery_dict in brewery_dict_list]
+            source = self._get(api_url)
+            brewery_dict_list = self._decode(source)
+            return self._build(brewery_dict_list)
         except requests.exceptions.RequestException as e:
             SystemExit(e)
 
-    def autocomplete(self, query):
-        query = self._encode_val_for_api_url(query)
-        api_url = self.base_api_url + '/autocomplete?query' + self.equals \
-                                    + query
+    @instrumented()
+    def autocomplete(self, query, hydrate=True):
+        """
+        Returns the breweries suggested for query. With hydrate=False only
+        the BrewerySummary (id and name) of each suggestion is returned,
+        which takes a single request. Otherwise every suggestion is
+        fetched in full, from the by-id cache where possible and with up
+        to max_workers requests at once for the rest.
+        """
+        if self.search_index is not None:
+            breweries = self.search_index.autocomplete(query)
+            if not breweries:
+                raise Exception("No breweries matched the autocomplete query.")
+            if not hydrate:
+                return [BrewerySummary(brewery.id, brewery.name)
+                        for brewery in breweries]
+            return breweries
+        api_url = self._autocomplete_api_url(query)
         try:
-            source = requests.get(api_url).text
-            brewery_dict_list = json.loads(source)
+            source = self._get(api_url)
+            brewery_dict_list = self._decode(source)
             if brewery_dict_list:
-                return [self.get_brewery_by_id(brewery_dict["id"])
-                        for brewery_dict in brewery_dict_list]
+                if not hydrate:
+                    return [BrewerySummary(brewery_dict["id"],
+                                           brewery_dict["name"])
+                            for brewery_dict in brewery_dict_list]
+                return self._hydrate([brewery_dict["id"]
+                                      for brewery_dict in brewery_dict_list])
             else:
                 raise Exception("No breweries matched the autocomplete query.")
         except requests.exceptions.RequestException as e:
             SystemExit(e)
 
-    def _encode_val_for_api_url(self, val):
-        return val.lower().replace(' ', '_')
-
-    def _assemble_api_url(self, key, val, page):
-        return self.base_api_url + self.results_per_page + key + self.equals \
-               + val + '&page=' + str(page)
+    def _hydrate(self, ids):
+        breweries = [self._cached_brewery(id) for id in ids]
+        missing = [i for i, brewery in enumerate(breweries) if brewery is None]
+        if len(missing) > 1 and self.max_workers > 1:
+            fetched = self._get_executor().map(
+                self.get_brewery_by_id, [ids[i] for i in missing])
+        else:
+            fetched = map(self.get_brewery_by_id, [ids[i] for i in missing])
+        for i, brewery in zip(missing, fetched):
+            breweries[i] = brewery
+        return breweries
 
+    @instrumented('page')
     def _request_breweries(self, key, val, page):
         try:
-            source = requests.get(self._assemble_api_url(key, val, page)).text
-            brewery_dict_list = json.loads(source)
-            return [Brewery(brewery_dict) for brewery_dict in brewery_dict_list]
+            source = self._get(self._assemble_api_url(key, val, page))
+            brewery_dict_list = self._decode(source)
+            return self._build(brewery_dict_list)
         except requests.exceptions.RequestException as e:
             raise SystemExit(e)
 
-    def _query(self, key, val):
-        rv = []
+    def _pages(self, key, val, prefetch=True):
+        """
+        Yields the pages of breweries for key=val in order. The first page
+        is requested on its own, so a query with a single page of results
+        makes a single request. After a full first page up to max_workers
+        pages are in flight at once, or only the page being read without
+        prefetch, and no new page is requested once a page comes back with
+        fewer than RESULTS_PER_PAGE breweries or the generator is closed.
+        """
+        breweries = self._request_breweries(key, val, 1)
+        yield breweries
+        if len(breweries) < self.RESULTS_PER_PAGE:
+            return
+        next_page = 2
+        if self.max_workers == 1 or not prefetch:
+            while True:
+                breweries = self._request_breweries(key, val, next_page)
+                yield breweries
+                if len(breweries) < self.RESULTS_PER_PAGE:
+                    return
+                next_page += 1
+        executor = self._get_executor()
+        in_flight = deque()
+        try:
+            while True:
+                while len(in_flight) < self.max_workers:
+                    in_flight.append(executor.submit(
+                        self._request_breweries, key, val, next_page))
+                    next_page += 1
+                breweries = in_flight.popleft().result()
+                yield breweries
+                if len(breweries) < self.RESULTS_PER_PAGE:
+                    return
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    def iter_all(self, sort='id'):
+        """
+        Yields every brewery in the database, ordered by the API sort
+        expression sort, such as 'name' or '-updated_at' for the most
+        recently updated first.
+        """
+        for breweries in self._pages('sort', sort):
+            yield from breweries
+
+    def _iter_query(self, key, val, prefetch=True):
         val = self._encode_val_for_api_url(val)
-        page = 1
-        while True:
-            breweries = self._request_breweries(key, val, page)
-            if breweries:
-                rv += breweries
-                page += 1
-            else:
-                break
+        start = time.perf_counter()
+        pages = 0
+        try:
+            if self.backend is not None:
+                yield from self.backend.query(key, val)
+                return
+            for breweries in self._pages(key, val, prefetch):
+                pages += 1
+                yield from breweries
+        finally:
+            # For the iter_by_* generators this includes the time spent
+            # by the caller between breweries.
+            if self.instrument is not None:
+                self._emit(key, start, pages=pages)
+
+    def bulk(self, queries):
+        """
+        Runs many by_* queries, given as (key, val) pairs such as
+        ('by_postal', '94104'), and yields a BulkResult for each as soon
+        as it completes, with the breweries found (an empty list when
+        none match), the seconds it took from its first request and the
+        exception that stopped it, if any. Queries with the same key and
+        encoded value are run and reported once.
+
+        The queries share the executor that the by_* queries fetch their
+        pages on. Each query has one page request in flight at a time,
+        and up to max_workers queries are in flight at once. When the
+        generator is closed early, the requests still queued are
+        cancelled.
+        """
+        pending = deque()
+        seen = set()
+        for key, val in queries:
+            if key not in self.QUERY_KEYS:
+                raise ValueError('Unknown query key {!r}.'.format(key))
+            encoded = self._encode_val_for_api_url(val)
+            if (key, encoded) not in seen:
+                seen.add((key, encoded))
+                pending.append((key, val, encoded))
+        if self.backend is not None:
+            for key, val, encoded in pending:
+                start = time.perf_counter()
+                breweries = self.backend.query(key, encoded)
+                yield BulkResult(key, val, breweries,
+                                 time.perf_counter() - start, None)
+            return
+        executor = self._get_executor()
+        running = {}
+        try:
+            while pending or running:
+                while pending and len(running) < self.max_workers:
+                    key, val, encoded = pending.popleft()
+                    future = executor.submit(self._request_breweries, key,
+                                             encoded, 1)
+                    running[future] = (key, val, encoded, 1, [],
+                                       time.perf_counter())
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key, val, encoded, page, rv, start = running.pop(future)
+                    try:
+                        breweries = future.result()
+                    except (Exception, SystemExit) as e:
+                        yield BulkResult(key, val, rv,
+                                         time.perf_counter() - start, e)
+                        continue
+                    rv += breweries
+                    if len(breweries) < self.RESULTS_PER_PAGE:
+                        if self.instrument is not None:
+                            self._emit(key, start, pages=page)
+                        yield BulkResult(key, val, rv,
+                                         time.perf_counter() - start, None)
+                    else:
+                        future = executor.submit(self._request_breweries,
+                                                 key, encoded, page + 1)
+                        running[future] = (key, val, encoded, page + 1, rv,
+                                           start)
+        finally:
+            for future in running:
+                future.cancel()
+
+    def _query(self, key, val):
+        if self.single_flight is None:
+            rv = list(self._iter_query(key, val))
+        else:
+            # Coalesce whole crawls as well as single requests, since the
+            # page requests of identical crawls queue up on the executor
+            # one after another and rarely overlap. The key names the
+            # server and backend too, as the SingleFlight may be shared
+            # by queries pointed at different ones.
+            flight_key = (self.base_api_url, id(self.backend), key,
+                          self._encode_val_for_api_url(val))
+            rv = list(self.single_flight.do(flight_key, lambda: list(
+                self._iter_query(key, val))))
         if rv:
             return rv
         else:
@@ -0,0 +1,1020 @@
+"""
+Benchmarks for the BreweryQuery client in openbrewapi.py, run against
+StubBreweryServer, a local stand-in for the Open Brewery Database API, so
+that no network access is needed and latency can be controlled.
+
+Run the module directly to print every benchmark:
+
+    python openbrewapi_benchmarks.py
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import random
+import tempfile
+import threading
+import sys
+import time
+import tracemalloc
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from async_openbrewapi import AsyncBreweryQuery
+from brewery_cache import ResponseCache
+from brewery_search import SearchIndex
+from brewery_snapshot import BrewerySnapshot
+from brewery_stats import QueryStats
+from openbrewapi import (Brewery, BreweryQuery, SingleFlight, TokenBucket,
+                         json_loads)
+
+
+BREWERY_TYPES = ('micro', 'brewpub', 'regional', 'large', 'contract')
+
+
+def make_brewery(i, key=None, val=None):
+    """
+    Returns the dictionary for stub brewery number i. When the brewery
+    is part of the result of a by_<field> query the field is set to the
+    queried value so callers can check what they were sent.
+    """
+    brewery = {
+        'id': i,
+        'name': 'Brewery {}'.format(i),
+        'brewery_type': BREWERY_TYPES[i % len(BREWERY_TYPES)],
+        'street': '{} Main St'.format(i),
+        'city': 'City {}'.format(i % 97),
+        'state': 'State {}'.format(i % 50),
+        'postal_code': '{:05d}'.format(i % 100000),
+        'country': 'United States',
+        'longitude': str(-122.0 + i * 1e-4),
+        'latitude': str(37.0 + i * 1e-4),
+        'phone': '555{:07d}'.format(i),
+        'website_url': 'http://brewery{}.example.com'.format(i),
+        'updated_at': '2018-08-24T00:00:00.000Z',
+        'tag_list': ['patio'] if i % 7 == 0 else [],
+    }
+    field = {'by_city': 'city', 'by_name': 'name', 'by_state': 'state',
+             'by_postal': 'postal_code', 'by_type': 'brewery_type',
+             'by_tag': 'tag_list'}.get(key)
+    if field == 'tag_list':
+        brewery['tag_list'] = [val]
+    elif field is not None:
+        brewery[field] = val
+    return brewery
+
+
+class StubBreweryServer:
+    """
+    Serves the Open Brewery Database endpoints used by BreweryQuery from
+    a local threaded HTTP server with keep-alive. Every by_<field> query
+    matches total breweries. latency seconds are slept before each
+    response, and the first failures requests are answered with 503 and
+    a Retry-After header. Successful responses carry an ETag, and
+    requests whose If-None-Match matches it are answered with 304.
+    requests and connections count what the server has seen.
+
+    Listing /breweries without a by_<field> filter returns the whole
+    database, most recently updated first with sort=-updated_at, and
+    touch(ids) marks breweries as updated.
+    """
+
+    def __init__(self, total=120, latency=0.0, failures=0, retry_after=0):
+        self.total = total
+        self.latency = latency
+        self.failures = failures
+        self.retry_after = retry_after
+        self.requests = 0
+        self.connections = 0
+        self.updated = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_api_url(self):
+        return 'http://127.0.0.1:{}/breweries'.format(
+            self._server.server_address[1])
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                           self._make_handler())
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever,
+                                  daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, attribute):
+        with self._lock:
+            value = getattr(self, attribute) + 1
+            setattr(self, attribute, value)
+            return value
+
+    def touch(self, ids, updated_at='2030-01-01T00:00:00.000Z'):
+        for i in ids:
+            self.updated[i] = updated_at
+
+    def _brewery(self, i, key=None, val=None):
+        brewery = make_brewery(i, key, val)
+        brewery['updated_at'] = self.updated.get(i, brewery['updated_at'])
+        return brewery
+
+    def respond(self, path, params):
+        """
+        Returns the status and JSON body for a request to path with the
+        parsed query string params.
+        """
+        if self._count('requests') <= self.failures:
+            return 503, {'message': 'Service Unavailable'}
+        if self.latency:
+            time.sleep(self.latency)
+        parts = path.rstrip('/').split('/')
+        if parts[-1] == 'breweries':
+            per_page = int(params.get('per_page', ['20'])[0])
+            page = int(params.get('page', ['1'])[0])
+            key = next((k for k in params if k.startswith('by_')), None)
+            val = params[key][0] if key else None
+            ids = range(1, self.total + 1)
+            if params.get('sort') == ['-updated_at']:
+                ids = sorted(ids, reverse=True, key=lambda i: self._brewery(
+                    i)['updated_at'])
+            return 200, [self._brewery(i, key, val)
+                         for i in ids[(page - 1) * per_page:page * per_page]]
+        if parts[-1] == 'search':
+            return 200, [self._brewery(i)
+                         for i in range(1, min(self.total, 50) + 1)]
+        if parts[-1] == 'autocomplete':
+            return 200, [{'id': str(i), 'name': 'Brewery {}'.format(i)}
+                         for i in range(1, min(self.total, 15) + 1)]
+        if parts[-1].isdigit() and 0 < int(parts[-1]) <= self.total:
+            return 200, self._brewery(int(parts[-1]))
+        return 404, {'message': "Couldn't find Brewery"}
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                stub._count('connections')
+
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionError:
+                    pass
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                status, payload = stub.respond(url.path, parse_qs(url.query))
+                body = json.dumps(payload).encode()
+                etag = '"{:08x}"'.format(zlib.crc32(body))
+                if status == 200 \
+                        and self.headers.get('If-None-Match') == etag:
+                    status, body = 304, b''
+                self.send_response(status)
+                if status in (200, 304):
+                    self.send_header('ETag', etag)
+                if status == 503:
+                    self.send_header('Retry-After', str(stub.retry_after))
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def _report(name, reference_time, new_time):
+    print('{:<44} reference {:>9.4f}s  new {:>9.4f}s  speed up {:>6.1f}x'
+          .format(name, reference_time, new_time, reference_time / new_time))
+
+
+def benchmark_session(calls=300):
+    """
+    Times get_brewery_by_id through the pooled session against a bare
+    requests.get per call, which opens a new connection every time.
+    """
+    with StubBreweryServer() as server:
+        url = server.base_api_url + '/1'
+        start = time.perf_counter()
+        for _ in range(calls):
+            json.loads(requests.get(url).text)
+        reference_time = time.perf_counter() - start
+
+        connections = server.connections
+        with BreweryQuery(base_api_url=server.base_api_url,
+                          cache_size=0) as query:
+            start = time.perf_counter()
+            for _ in range(calls):
+                query.get_brewery_by_id(1)
+            new_time = time.perf_counter() - start
+        _report('get_brewery_by_id ({} calls)'.format(calls),
+                reference_time, new_time)
+        print('{:<44} bare {:>5}  pooled {:>5}'.format(
+            'connections opened', connections,
+            server.connections - connections))
+
+
+def benchmark_retry():
+    """
+    Checks that a query succeeds through 503 responses with Retry-After
+    and prints the number of requests it took.
+    """
+    with StubBreweryServer(failures=2) as server:
+        with BreweryQuery(base_api_url=server.base_api_url,
+                          backoff_factor=0.01) as query:
+            brewery = query.get_brewery_by_id(7)
+        print('{:<44} {} after {} requests'.format(
+            'retry through 503', brewery.name, server.requests))
+
+
+def benchmark_pagination(total=1000, latency=0.02):
+    """
+    Times a by_state query returning total breweries from a server that
+    takes latency seconds per page, fetching one page at a time against
+    fetching pages concurrently, and checks that both return the same
+    breweries in the same order and that a query with a single page of
+    results makes a single request with either client.
+    """
+    results = {}
+    for max_workers in (1, 4, 8):
+        with StubBreweryServer(total=total, latency=latency) as server:
+            with BreweryQuery(base_api_url=server.base_api_url,
+                              max_workers=max_workers) as query:
+                start = time.perf_counter()
+                breweries = query.by_state('California')
+                elapsed = time.perf_counter() - start
+            results[max_workers] = (elapsed, [b.id for b in breweries],
+                                    server.requests)
+    reference_time, reference_ids, reference_requests = results[1]
+    for max_workers in (4, 8):
+        new_time, ids, requests_made = results[max_workers]
+        assert ids == reference_ids
+        _report('by_state {} pages, max_workers={}'.format(
+                    len(ids) // BreweryQuery.RESULTS_PER_PAGE, max_workers),
+                reference_time, new_time)
+        print('{:<44} serial {:>4}  concurrent {:>4}'.format(
+            'requests made', reference_requests, requests_made))
+
+    with StubBreweryServer(total=BreweryQuery.RESULTS_PER_PAGE - 1) as server:
+        with BreweryQuery(base_api_url=server.base_api_url,
+                          max_workers=8) as query:
+            query.by_state('California')
+        assert server.requests == 1, server.requests
+
+        async def run_query():
+            async with AsyncBreweryQuery(
+                    base_api_url=server.base_api_url) as query:
+                await query.by_state('California')
+
+        asyncio.run(run_query())
+        assert server.requests == 2, server.requests
+
+
+def benchmark_autocomplete(latency=0.02):
+    """
+    Times autocomplete hydrating its 15 hits one request at a time
+    against hydrating them concurrently, then from a warm by-id cache and
+    without hydration.
+    """
+    with StubBreweryServer(latency=latency) as server:
+        with BreweryQuery(base_api_url=server.base_api_url, max_workers=1,
+                          cache_size=0) as query:
+            start = time.perf_counter()
+            reference = query.autocomplete('bad')
+            reference_time = time.perf_counter() - start
+        reference_names = [brewery.name for brewery in reference]
+        with BreweryQuery(base_api_url=server.base_api_url,
+                          max_workers=8) as query:
+            for name in ('concurrent', 'cached'):
+                requests_made = server.requests
+                start = time.perf_counter()
+                breweries = query.autocomplete('bad')
+                new_time = time.perf_counter() - start
+                assert [brewery.name for brewery in breweries] \
+                    == reference_names
+                _report('autocomplete {}, {} requests'.format(
+                            name, server.requests - requests_made),
+                        reference_time, new_time)
+            start = time.perf_counter()
+            summaries = query.autocomplete('bad', hydrate=False)
+            new_time = time.perf_counter() - start
+            assert [summary.name for summary in summaries] == reference_names
+            _report('autocomplete, hydrate=False', reference_time, new_time)
+
+
+def benchmark_cache(repeats=20, latency=0.02):
+    """
+    Times repeated by_city and search queries without a response cache
+    and with one, with a cache whose entries are always stale so every
+    query is revalidated with a 304, and with a fresh BreweryQuery
+    reading the responses back from the cache's SQLite file.
+    """
+    def run(query):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            query.by_city('San Francisco')
+            query.search('cat')
+        return time.perf_counter() - start
+
+    with StubBreweryServer(latency=latency) as server:
+        with BreweryQuery(base_api_url=server.base_api_url) as query:
+            reference_time = run(query)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'responses.sqlite')
+            for name, cache in (('ttl=300', ResponseCache(path=path)),
+                                ('ttl=0, revalidated', ResponseCache(ttl=0))):
+                with BreweryQuery(base_api_url=server.base_api_url,
+                                  cache=cache) as query:
+                    new_time = run(query)
+                _report('response cache {}'.format(name),
+                        reference_time, new_time)
+                print('{:<44} {}'.format('', cache.cache_info()))
+                cache.close()
+            cache = ResponseCache(path=path)
+            requests_made = server.requests
+            with BreweryQuery(base_api_url=server.base_api_url,
+                              cache=cache) as query:
+                new_time = run(query)
+            cache.close()
+            _report('response cache from SQLite ({} requests)'.format(
+                        server.requests - requests_made),
+                    reference_time, new_time)
+
+
+def benchmark_snapshot(total=5000, repeats=200, latency=0.02):
+    """
+    Times syncing a snapshot of total breweries and an incremental
+    refresh after a few are updated, then the by_* queries answered by
+    the snapshot, and get_brewery_by_id answered by the API against the
+    snapshot. The stub server does not filter its by_* results, so
+    those are not compared with the API.
+    """
+    queries = (('by_city', 'City 12'), ('by_state', 'State 7'),
+               ('by_postal', '0012'), ('by_type', 'brewpub'),
+               ('by_tag', 'patio'), ('by_name', 'Brewery 49'))
+    with StubBreweryServer(total=total, latency=latency) as server:
+        snapshot = BrewerySnapshot()
+        with BreweryQuery(base_api_url=server.base_api_url,
+                          cache_size=0) as query:
+            start = time.perf_counter()
+            count = snapshot.sync(query)
+            print('{:<44} {} breweries in {:.3f}s'.format(
+                'snapshot sync', count, time.perf_counter() - start))
+
+            server.touch([3, 1415, 4999])
+            requests_made = server.requests
+            start = time.perf_counter()
+            count = snapshot.refresh(query)
+            print('{:<44} {} breweries in {:.3f}s, {} requests'.format(
+                'snapshot refresh', count, time.perf_counter() - start,
+                server.requests - requests_made))
+            assert snapshot.get(1415).updated_at == server.updated[1415]
+
+            start = time.perf_counter()
+            for i in range(1, 21):
+                query.get_brewery_by_id(i)
+            reference_time = (time.perf_counter() - start) / 20
+
+        with BreweryQuery(backend=snapshot, cache_size=0) as query:
+            for name, val in queries:
+                count = len(getattr(query, name)(val))
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    getattr(query, name)(val)
+                elapsed = (time.perf_counter() - start) / repeats
+                print('{:<44} {:>5} breweries in {:>8.1f}us'.format(
+                    'snapshot {}({!r})'.format(name, val), count,
+                    elapsed * 1e6))
+            start = time.perf_counter()
+            for _ in range(repeats):
+                for i in range(1, 21):
+                    query.get_brewery_by_id(i)
+            new_time = (time.perf_counter() - start) / repeats / 20
+        _report('get_brewery_by_id, API against snapshot',
+                reference_time, new_time)
+
+
+def benchmark_streaming(total=1000, latency=0.02, wanted=60):
+    """
+    Times the first brewery of a 20 page by_state query from by_state
+    against iter_by_state, and counts the requests made when only the
+    first wanted breweries are used, with and without prefetch, on both
+    clients.
+    """
+    with StubBreweryServer(total=total, latency=latency) as server:
+        with BreweryQuery(base_api_url=server.base_api_url) as query:
+            start = time.perf_counter()
+            query.by_state('California')[0]
+            reference_time = time.perf_counter() - start
+            start = time.perf_counter()
+            breweries = query.iter_by_state('California')
+            next(breweries)
+            new_time = time.perf_counter() - start
+            breweries.close()
+            _report('first brewery, iter_by_state',
+                    reference_time, new_time)
+
+            for prefetch in (True, False):
+                time.sleep(latency * 2)
+                requests_made = server.requests
+                for i, brewery in enumerate(
+                        query.iter_by_state('California', prefetch)):
+                    if i + 1 == wanted:
+                        break
+                time.sleep(latency * 2)
+                print('{:<44} {} requests'.format(
+                    'first {} breweries, prefetch={}'.format(
+                        wanted, prefetch),
+                    server.requests - requests_made))
+
+        async def first_breweries(prefetch):
+            async with AsyncBreweryQuery(
+                    base_api_url=server.base_api_url) as query:
+                start = time.perf_counter()
+                async with contextlib.aclosing(
+                        query.iter_by_state('California', prefetch)) \
+                        as breweries:
+                    async for brewery in breweries:
+                        elapsed = time.perf_counter() - start
+                        break
+                return elapsed
+
+        for prefetch in (True, False):
+            requests_made = server.requests
+            elapsed = asyncio.run(first_breweries(prefetch))
+            time.sleep(latency * 2)
+            print('{:<44} {:.4f}s, {} requests'.format(
+                'async first brewery, prefetch={}'.format(prefetch),
+                elapsed, server.requests - requests_made))
+
+
+def _run_threads(count, target):
+    barrier = threading.Barrier(count)
+
+    def run(i):
+        barrier.wait()
+        target(i)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def benchmark_coalescing(threads=16, latency=0.05):
+    """
+    Counts the requests made when threads threads sharing one
+    BreweryQuery ask for the same city at the same moment, without and
+    with single-flight coalescing, and checks that queries sharing one
+    SingleFlight with different servers are not coalesced.
+    """
+    for single_flight in (False, True):
+        with StubBreweryServer(latency=latency) as server:
+            with BreweryQuery(base_api_url=server.base_api_url,
+                              single_flight=single_flight) as query:
+                results = [None] * threads
+                start = time.perf_counter()
+                _run_threads(threads, lambda i: results.__setitem__(
+                    i, query.by_city('San Francisco')))
+                elapsed = time.perf_counter() - start
+                assert all(len(result) == server.total for result in results)
+                info = query.single_flight.info() if single_flight else ''
+                print('{:<44} {:>4} requests in {:.3f}s {}'.format(
+                    '{} threads by_city, single_flight={}'.format(
+                        threads, single_flight),
+                    server.requests, elapsed, info))
+
+    # queries sharing a SingleFlight but talking to different servers
+    # must not be handed each other's results
+    single_flight = SingleFlight()
+    with StubBreweryServer(total=120, latency=latency) as large, \
+            StubBreweryServer(total=30, latency=latency) as small:
+        queries = [BreweryQuery(base_api_url=server.base_api_url,
+                                single_flight=single_flight)
+                   for server in (large, small)]
+        results = [None] * 2
+        _run_threads(2, lambda i: results.__setitem__(
+            i, queries[i].by_city('San Francisco')))
+        for query in queries:
+            query.close()
+    assert [len(result) for result in results] == [120, 30]
+    print('{:<44} {}'.format('shared single_flight, two servers',
+                             single_flight.info()))
+
+
+FIELD_OF_QUERY = {'by_city': 'city', 'by_name': 'name', 'by_state': 'state',
+                  'by_postal': 'postal_code', 'by_type': 'brewery_type'}
+
+
+class _InterleavedQuery(BreweryQuery):
+    """
+    A BreweryQuery whose by_* calls wait for each other on a barrier
+    after choosing their query key and before calling _query, so that
+    two threads calling by_* at once always interleave there. A client
+    keeping the key in shared state, as the current_key attribute set by
+    a decorator once did, hands both calls the key written last.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._barrier = threading.Barrier(2, timeout=5)
+
+    @property
+    def _query(self):
+        self._barrier.wait()
+        return super()._query
+
+
+def check_interleaved_keys(latency=0.002):
+    """
+    Checks deterministically that a by_city and a by_name call forced to
+    interleave on one shared query each get the breweries for their own
+    key and value.
+    """
+    calls = (('by_city', 'Alpha'), ('by_name', 'Beta'))
+    with StubBreweryServer(total=60, latency=latency) as server:
+        with _InterleavedQuery(base_api_url=server.base_api_url) as query:
+            results = [None] * len(calls)
+            _run_threads(len(calls), lambda i: results.__setitem__(
+                i, getattr(query, calls[i][0])(calls[i][1])))
+    for (name, val), breweries in zip(calls, results):
+        got = {getattr(b, FIELD_OF_QUERY[name]) for b in breweries}
+        assert got == {query._encode_val_for_api_url(val)}, (name, got)
+    print('{:<44} ok'.format('interleaved by_city and by_name'))
+
+
+def stress_shared_query(threads=32, calls=25, latency=0.002):
+    """
+    Runs threads threads making calls random by_*, iter_by_*,
+    get_brewery_by_id and autocomplete calls each on one shared
+    BreweryQuery, and checks that every result belongs to the call that
+    asked for it: the stub server echoes the queried value back in the
+    queried field, so a key or value crossing threads shows up as a
+    mismatch. The interpreter switches threads as often as it can
+    meanwhile, to widen any race.
+    """
+    errors = []
+    with StubBreweryServer(total=120, latency=latency) as server:
+        with BreweryQuery(base_api_url=server.base_api_url,
+                          cache_size=64) as query:
+
+            def check(i):
+                rng = random.Random(i)
+                for _ in range(calls):
+                    name = rng.choice(QUERIES)[0]
+                    val = 'Value {}'.format(rng.randrange(20))
+                    expected = query._encode_val_for_api_url(val)
+                    choice = rng.random()
+                    try:
+                        if choice < 0.6:
+                            if choice < 0.4:
+                                breweries = getattr(query, name)(val)
+                            else:
+                                breweries = list(getattr(
+                                    query, 'iter_' + name)(val))
+                            if name == 'by_tag':
+                                got = {tuple(b.tag_list) for b in breweries}
+                                expected = (expected,)
+                            else:
+                                got = {getattr(b, FIELD_OF_QUERY[name])
+                                       for b in breweries}
+                            if got != {expected} \
+                                    or len(breweries) != server.total:
+                                errors.append((name, val, got))
+                        elif choice < 0.9:
+                            id = rng.randrange(1, server.total + 1)
+                            if query.get_brewery_by_id(id).id != id:
+                                errors.append(('get_brewery_by_id', id))
+                        else:
+                            if len(query.autocomplete(val)) != 15:
+                                errors.append(('autocomplete', val))
+                    except Exception as e:
+                        errors.append((name, val, repr(e)))
+
+            switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(1e-6)
+            try:
+                start = time.perf_counter()
+                _run_threads(threads, check)
+                elapsed = time.perf_counter() - start
+            finally:
+                sys.setswitchinterval(switch_interval)
+    print('{:<44} {} calls in {:.3f}s, {} requests, {} errors'.format(
+        'shared query, {} threads'.format(threads), threads * calls,
+        elapsed, server.requests, len(errors)))
+    assert not errors, errors[:5]
+
+
+def benchmark_bulk(postal_codes=100, duplicates=20, total=60, latency=0.02):
+    """
+    Times by_postal over postal_codes postal codes, plus duplicates
+    repeated ones, called one after another against the same queries
+    run through bulk, and reports the per-query timings bulk returns.
+    """
+    codes = ['{:05d}'.format(94000 + i) for i in range(postal_codes)]
+    codes += codes[:duplicates]
+    with StubBreweryServer(total=total, latency=latency) as server:
+        with BreweryQuery(base_api_url=server.base_api_url,
+                          max_workers=8) as query:
+            start = time.perf_counter()
+            reference = {code: query.by_postal(code) for code in codes}
+            reference_time = time.perf_counter() - start
+            reference_requests = server.requests
+
+            start = time.perf_counter()
+            results = list(query.bulk(('by_postal', code) for code in codes))
+            new_time = time.perf_counter() - start
+        assert len(results) == postal_codes
+        for result in results:
+            assert result.error is None
+            assert [b.brew_dict for b in result.breweries] \
+                == [b.brew_dict for b in reference[result.val]]
+        _report('{} by_postal queries, bulk'.format(len(codes)),
+                reference_time, new_time)
+        elapsed = sorted(result.elapsed for result in results)
+        print('{:<44} serial {:>4}  bulk {:>4}'.format(
+            'requests made', reference_requests,
+            server.requests - reference_requests))
+        print('{:<44} median {:.4f}s  max {:.4f}s'.format(
+            'bulk per-query time', elapsed[len(elapsed) // 2], elapsed[-1]))
+
+
+def benchmark_rate_limit(rate=100, capacity=10, threads=4, calls=50):
+    """
+    Runs threads threads split between two BreweryQuery objects sharing
+    one TokenBucket, each fetching calls breweries by id, and reports
+    the request rate the server saw.
+    """
+    bucket = TokenBucket(rate, capacity)
+    with StubBreweryServer(total=threads * calls) as server:
+        queries = [BreweryQuery(base_api_url=server.base_api_url,
+                                cache_size=0, rate_limiter=bucket)
+                   for _ in range(2)]
+
+        def fetch(i):
+            for id in range(i * calls + 1, (i + 1) * calls + 1):
+                queries[i % 2].get_brewery_by_id(id)
+
+        start = time.perf_counter()
+        _run_threads(threads, fetch)
+        elapsed = time.perf_counter() - start
+        for query in queries:
+            query.close()
+    print('{:<44} {:.0f} requests/s for a limit of {}/s'.format(
+        'shared token bucket', server.requests / elapsed, rate))
+    print('{:<44} {}'.format('', bucket.info()))
+
+
+class _DictBrewery:
+    """
+    The Brewery record as it was before it was slotted, copying every
+    field into an instance attribute and keeping the dictionary too.
+    """
+
+    def __init__(self, brew_dict):
+        self.brew_dict = brew_dict
+        for field in Brewery.FIELDS:
+            setattr(self, field, brew_dict[field])
+
+
+def _record_bytes(record_class, pages, loads):
+    tracemalloc.start()
+    records = [record_class(brew_dict) for page in pages
+               for brew_dict in loads(page)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size / len(records)
+
+
+def benchmark_records(pages=200, repeats=5):
+    """
+    Measures the memory per brewery record, and the throughput of
+    decoding 50 brewery pages into records: from the text of the
+    response with json and the old attribute-copying record, against
+    from its bytes with json_loads (orjson when it is installed) and
+    the slotted Brewery.
+    """
+    bodies = [json.dumps([make_brewery(i) for i in range(j * 50 + 1,
+                                                         j * 50 + 51)])
+              .encode() for j in range(pages)]
+
+    def old(body):
+        return [_DictBrewery(brew_dict)
+                for brew_dict in json.loads(body.decode())]
+
+    def new(body):
+        return [Brewery(brew_dict) for brew_dict in json_loads(body)]
+
+    times = []
+    for parse in (old, new):
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for body in bodies:
+                parse(body)
+            best = min(best, time.perf_counter() - start)
+        times.append(best)
+    _report('decode {} pages of 50 ({})'.format(
+                pages, json_loads.__module__.split('.')[0]), *times)
+    print('{:<44} old {:>7.0f}  new {:>7.0f}'.format(
+        'pages per second', pages / times[0], pages / times[1]))
+    print('{:<44} old {:>7.0f}  new {:>7.0f}'.format(
+        'bytes per record',
+        _record_bytes(_DictBrewery, bodies, json.loads),
+        _record_bytes(Brewery, bodies, json_loads)))
+
+
+NAME_WORDS = ('Bad', 'Weather', 'Anchor', 'Golden', 'Road', 'Dog', 'Fish',
+              'Stone', 'Lost', 'Coast', 'River', 'Mountain', 'Hop', 'Barrel',
+              'Black', 'Cat', 'Rusty', 'Iron', 'Crooked', 'Owl', 'Bear',
+              'Wolf', 'Raven', 'Pine', 'Harbor', 'Foggy', 'Saint', 'Old')
+NAME_ENDINGS = ('Brewing', 'Brewery', 'Brewing Company', 'Beer Co',
+                'Taproom', 'Ales', 'Brewpub')
+CITY_WORDS = ('San', 'Santa', 'Fort', 'Port', 'Lake', 'New', 'Saint', 'Cedar',
+              'Spring', 'Oak', 'Green', 'Red', 'Bend', 'Falls', 'Haven')
+
+
+def make_named_breweries(count, seed=0):
+    """
+    Returns count stub breweries with random names and cities built from
+    word lists.
+    """
+    rng = random.Random(seed)
+    breweries = []
+    for i in range(1, count + 1):
+        brew_dict = make_brewery(i)
+        brew_dict['name'] = ' '.join(
+            rng.sample(NAME_WORDS, rng.randint(1, 3))
+            + [rng.choice(NAME_ENDINGS)])
+        brew_dict['city'] = ' '.join(rng.sample(CITY_WORDS, 2))
+        breweries.append(Brewery(brew_dict))
+    return breweries
+
+
+def _percentiles(func, queries):
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        func(query)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2], times[int(len(times) * 0.99)]
+
+
+def _index_bytes(index):
+    """
+    Returns the bytes taken by the keys, document arrays and trigram
+    postings of the SearchIndex index, leaving out the breweries.
+    """
+    size = sys.getsizeof(index._grams)
+    for gram, docs in index._grams.items():
+        size += sys.getsizeof(gram) + sys.getsizeof(docs)
+    for keys, docs in ((index._name_keys, index._name_docs),
+                       (index._word_keys, index._word_docs)):
+        size += sys.getsizeof(keys) + sys.getsizeof(docs) \
+            + sum(sys.getsizeof(key) for key in keys)
+    return size
+
+
+def benchmark_search_index(sizes=(10000, 100000), queries=2000):
+    """
+    Reports the build time and memory of a SearchIndex over 10k and 100k
+    breweries, the median and 99th percentile latency of autocomplete
+    prefixes and search queries, and the time to add breweries to a
+    built index.
+    """
+    rng = random.Random(1)
+    prefixes = [rng.choice(NAME_WORDS + CITY_WORDS)[:rng.randint(1, 5)]
+                for _ in range(queries)]
+    words = [' '.join(rng.sample(NAME_WORDS, 2)) for _ in range(queries)]
+    for size in sizes:
+        breweries = make_named_breweries(size + 1000)
+        start = time.perf_counter()
+        index = SearchIndex(breweries[:size])
+        build_time = time.perf_counter() - start
+        memory = _index_bytes(index)
+        print('{:<44} {:.3f}s, {:.1f} MB'.format(
+            'search index build, {} breweries'.format(size), build_time,
+            memory / 2 ** 20))
+        for name, func, args in (('autocomplete', index.autocomplete,
+                                  prefixes),
+                                 ('search', index.search, words)):
+            median, p99 = _percentiles(func, args)
+            print('{:<44} median {:>7.1f}us  p99 {:>7.1f}us'.format(
+                '{}, {} breweries'.format(name, size),
+                median * 1e6, p99 * 1e6))
+        start = time.perf_counter()
+        for brewery in breweries[size:]:
+            index.add([brewery])
+        print('{:<44} {:>7.1f}us per brewery'.format(
+            'search index add, {} breweries'.format(size),
+            (time.perf_counter() - start) / 1000 * 1e6))
+
+
+QUERIES = (('by_city', 'San Francisco'), ('by_name', 'dog'),
+           ('by_state', 'California'), ('by_postal', '94104'),
+           ('by_type', 'micro'), ('by_tag', 'patio'))
+
+
+def benchmark_async(total=300, latency=0.02):
+    """
+    Times the six by_* queries run one after another on BreweryQuery
+    against running them together with asyncio.gather on
+    AsyncBreweryQuery, then checks retries and that cancelling a query
+    leaves the client usable.
+    """
+    with StubBreweryServer(total=total, latency=latency) as server:
+        with BreweryQuery(base_api_url=server.base_api_url) as query:
+            start = time.perf_counter()
+            reference = [getattr(query, name)(val) for name, val in QUERIES]
+            reference_time = time.perf_counter() - start
+
+        async def run_queries():
+            async with AsyncBreweryQuery(
+                    base_api_url=server.base_api_url) as query:
+                start = time.perf_counter()
+                results = await asyncio.gather(
+                    *(getattr(query, name)(val) for name, val in QUERIES))
+                elapsed = time.perf_counter() - start
+
+                task = asyncio.ensure_future(query.by_state('Oregon'))
+                await asyncio.sleep(latency / 2)
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                brewery = await query.get_brewery_by_id(3)
+                return results, elapsed, brewery
+
+        results, new_time, brewery = asyncio.run(run_queries())
+        for reference_breweries, breweries in zip(reference, results):
+            assert [b.brew_dict for b in reference_breweries] \
+                == [b.brew_dict for b in breweries]
+        assert brewery.id == 3
+        _report('{} by_* queries, asyncio.gather'.format(len(QUERIES)),
+                reference_time, new_time)
+
+    with StubBreweryServer(failures=2) as server:
+
+        async def retry():
+            async with AsyncBreweryQuery(base_api_url=server.base_api_url,
+                                         backoff_factor=0.01) as query:
+                return await query.get_brewery_by_id(7)
+
+        brewery = asyncio.run(retry())
+        print('{:<44} {} after {} requests'.format(
+            'async retry through 503', brewery.name, server.requests))
+
+
+class RecordingSession:
+    """
+    Wraps a requests.Session and keeps the body of every successful
+    response by URL, so the responses can be replayed later without the
+    network through ReplaySession.
+    """
+
+    def __init__(self, session=None):
+        self.session = session if session is not None else requests.Session()
+        self.bodies = {}
+
+    def get(self, url, **kwargs):
+        response = self.session.get(url, **kwargs)
+        if response.status_code == 200:
+            self.bodies[url] = response.content
+        return response
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({url: body.decode() for url, body in self.bodies.items()},
+                      f)
+
+    def close(self):
+        self.session.close()
+
+
+class _ReplayResponse:
+
+    status_code = 200
+
+    def __init__(self, content):
+        self.content = content
+        self.headers = {}
+
+
+class ReplaySession:
+    """
+    Stands in for the session of a BreweryQuery, answering every GET
+    from recorded bodies, keyed by URL. A URL that was not recorded
+    raises KeyError, so a replay cannot silently differ from the
+    recording.
+    """
+
+    def __init__(self, bodies):
+        self.bodies = bodies
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls({url: body.encode() for url, body in json.load(f).items()})
+
+    def get(self, url, **kwargs):
+        if url not in self.bodies:
+            raise KeyError('No response was recorded for {}'.format(url))
+        return _ReplayResponse(self.bodies[url])
+
+    def close(self):
+        pass
+
+
+def _replayed_calls(query):
+    query.by_state('California')
+    query.search('bad')
+    query.autocomplete('bad', hydrate=False)
+
+
+def benchmark_instrumentation(total=1000, latency=0.02, repeats=20):
+    """
+    Prints the QueryStats of a by_state query, a search and an
+    autocomplete against the stub server, showing how the time of each
+    call splits between requests, decoding and building records. The
+    responses are recorded and replayed repeats times without the
+    network, one page at a time, first uninstrumented and then
+    instrumented, which prints the parse and construct costs alone and
+    what the instrumentation adds to them.
+    """
+    stats = QueryStats()
+    with StubBreweryServer(total=total, latency=latency) as server:
+        session = RecordingSession()
+        with BreweryQuery(base_api_url=server.base_api_url, session=session,
+                          instrument=stats) as query:
+            _replayed_calls(query)
+    print('live, {} ms stub latency'.format(latency * 1000))
+    print(stats.report())
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'responses.json')
+        session.save(path)
+        replay = ReplaySession.load(path)
+    stats = QueryStats()
+    times = {None: float('inf'), stats: float('inf')}
+    # Alternate the two so that warming up does not favor either.
+    for _ in range(3):
+        for instrument in times:
+            stats.reset()
+            with BreweryQuery(base_api_url=server.base_api_url,
+                              session=replay, max_workers=1, cache_size=0,
+                              instrument=instrument) as query:
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    _replayed_calls(query)
+                times[instrument] = min(times[instrument],
+                                        time.perf_counter() - start)
+    print('replayed {} times, {} responses'.format(repeats,
+                                                   len(replay.bodies)))
+    print(stats.report())
+    print('{:<44} plain {:>9.4f}s  instrumented {:>9.4f}s'.format(
+        'instrumentation overhead', times[None], times[stats]))
+
+
+if __name__ == '__main__':
+
+    benchmark_session()
+    benchmark_retry()
+    benchmark_records()
+    benchmark_pagination()
+    benchmark_autocomplete()
+    benchmark_streaming()
+    benchmark_cache()
+    benchmark_coalescing()
+    check_interleaved_keys()
+    stress_shared_query()
+    benchmark_bulk()
+    benchmark_rate_limit()
+    benchmark_snapshot()
+    benchmark_search_index()
+    benchmark_async()
+    benchmark_instrumentation()
@@ -1,8 +1,58 @@
 # Author: Barrett
 
+from collections import namedtuple
+from fractions import Fraction
+from numbers import Integral, Number
+
 import numpy as np
 
 
+# Crossover points for _multiply, chosen with benchmark_multiply_crossover
+# in polynomial_benchmarks.py. Inputs whose shorter side has at most
+# CONVOLVE_CUTOFF[dtype kind] coefficients use np.convolve, which is also
+# the base case of the Karatsuba recursion. Floating point inputs whose
+# shorter side has at least FFT_CUTOFF coefficients use the FFT. np.convolve
+# beats Karatsuba on floats right up to the point where the FFT takes
+# over, so floats go straight from np.convolve to the FFT.
+CONVOLVE_CUTOFF = {'O': 8, 'i': 512, 'f': 512}
+FFT_CUTOFF = 512
+
+# Largest magnitude an int64 coefficient can hold. Integer operations
+# whose results could be larger are done on Python integers in object
+# arrays instead, so they stay exact rather than wrapping around.
+INT_MAX = int(np.iinfo(np.int64).max)
+
+# Relative tolerance used when deciding whether a numerically computed
+# root is real and whether nearby roots are copies of one multiple root.
+# Multiple roots are only determined to about the cube root of machine
+# precision so this is much looser than the precision of simple roots.
+ROOT_TOL = 1e-5
+
+# Upper limit on the number of pieces Poly.compile uses when it picks the
+# number of pieces of a piecewise table itself.
+MAX_PIECES = 1 << 16
+
+# Number of points a CompiledPoly evaluates at a time, small enough for
+# the working buffers of the Clenshaw recurrence to stay in cache.
+EVAL_BLOCK = 1 << 13
+
+# Floating point division with both the quotient and the divisor at
+# least this long uses the Newton iteration in _fast_divmod instead of
+# schoolbook division. Exact coefficients always use schoolbook division
+# because the power series inverse makes their size grow quickly. Chosen
+# with benchmark_division in polynomial_benchmarks.py.
+DIVISION_CUTOFF = 32
+
+# compose uses Horner's scheme for pieces of at most this many
+# coefficients.
+COMPOSE_LEAF = 8
+
+Extremum = namedtuple('Extremum', ['x', 'value', 'kind'])
+OptimizeResult = namedtuple('OptimizeResult',
+                            ['x', 'value', 'iterations', 'converged'])
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'currsize'])
+
+
 class Poly:
 
 	"""
@@ -17,18 +67,113 @@ class Poly:
 	supplied which is flexible in the format the polynomial is printed.
 	"""
 
+	__slots__ = ('_coefs', '_owner', '_cache', '_cache_hits',
+	             '_cache_misses')
+
 	def __init__(self, *args):
-		self.coefs = list(args)
+		self.coefs = args
+
+	@classmethod
+	def _from_coefs(cls, coefs, owner=True):
+		"""
+		Wraps the coefficient array coefs in a new polynomial object
+		without copying it. owner says whether the new object is the only
+		user of the array and may update it in place; arrays shared with
+		other objects are copied before the first in-place update.
+		"""
+		rv = cls.__new__(cls)
+		rv._set(coefs, owner)
+		return rv
+
+	@property
+	def coefs(self):
+		"""
+		The read-only array of coefficients, lowest power first. Assign
+		a new sequence to change the polynomial; doing so clears the
+		cache of derived polynomials.
+		"""
+		return self._coefs
+
+	@coefs.setter
+	def coefs(self, value):
+		self._set(_coef_array(value), True)
+
+	def _set(self, coefs, owner):
+		coefs.setflags(write=False)
+		self._coefs = coefs
+		self._owner = owner
+		self._cache = None
+		self._cache_hits = 0
+		self._cache_misses = 0
+
+	def _cached(self, key, compute):
+		"""
+		Returns the read-only coefficient array stored under key in the
+		cache of derived polynomials, computing and storing it on a miss.
+		"""
+		if self._cache is None:
+			self._cache = {}
+		try:
+			rv = self._cache[key]
+		except KeyError:
+			self._cache_misses += 1
+			rv = self._cache[key] = compute()
+			rv.setflags(write=False)
+		else:
+			self._cache_hits += 1
+		return rv
+
+	def cache_info(self):
+		"""
+		Returns a CacheInfo tuple with the hit and miss counts and the
+		current size of the cache of derived polynomials.
+		"""
+		return CacheInfo(self._cache_hits, self._cache_misses,
+		                 len(self._cache or ()))
+
+	def cache_clear(self):
+		"""
+		Empties the cache of derived polynomials and resets its counters.
+		"""
+		self._set(self._coefs, self._owner)
+
+	def freeze(self):
+		"""
+		Returns a FrozenPoly with the same coefficients. The coefficient
+		array is handed over without copying, and this object copies it
+		before its next in-place update.
+		"""
+		self._owner = False
+		return FrozenPoly._from_coefs(self._coefs, False)
 
 	def __call__(self, x):
 		"""
 		Polu polynomial class objects are callable and when
 		called calculate the polynomial function value at the specified
 		x value.
+
+		The value is computed with Horner's scheme. x may be a scalar,
+		a list or a NumPy array; lists and arrays are evaluated
+		elementwise and an array of the same shape is returned.
 		"""
+		if isinstance(x, (list, tuple, np.ndarray)):
+			return self._horner_array(np.asarray(x))
 		rv = 0
-		for i in range(len(self.coefs)):
-			rv += self.coefs[i] * (x ** i)
+		for c in reversed(self.coefs.tolist()):
+			rv = rv * x + c
+		return rv
+
+	def _horner_array(self, x):
+		"""
+		Evaluates the polynomial at every element of the array x using
+		Horner's scheme. The loop runs once per coefficient and updates
+		a single result buffer in place.
+		"""
+		coefs, x = _widen(self.coefs, x, _horner_bound)
+		rv = np.zeros(x.shape, dtype=np.result_type(x, coefs))
+		for c in coefs[::-1]:
+			rv *= x
+			rv += c
 		return rv
 
 	def __repr__(self):
@@ -46,58 +191,28 @@ class Poly:
 		this polynomial object as a string.
 		"""
 
-		# print format options
-		plus = ' + '
-		minus = ' - '
-		x_power_str = '^'
-		x_str = 'x'
-
-		rstr = ''
-		for i in range(len(self.coefs)):
+		return _format_terms(enumerate(self.coefs))
 
-			# get coefficient and create coefficient string
-			c = self.coefs[i]
-			if abs(c) == 1:
-				coef_str = ''
-			else:
-				coef_str = str(abs(c))
-
-			# concatenate each polynomial term to rstr
-			if i == 0:
-				rstr += str(self.coefs[i])
-			elif i == 1:
-				if c == 0:
-					pass
-				elif c < 0:
-					rstr += minus + coef_str + x_str
-				else:
-					rstr += plus + coef_str + x_str
-			else:
-				if c == 0:
-					pass
-				elif c < 0:
-					rstr += minus + coef_str + x_str + x_power_str + str(i)
-				else:
-					rstr += plus + coef_str + x_str + x_power_str + str(i)
-
-		return rstr
-
-	def derivative(self):
+	def derivative(self, n=1):
 		"""
 		Returns a polynomial object instance which is the
-		derivative of the polynomial object.
+		nth derivative of the polynomial object. Every derivative on the
+		way to the nth is cached until the polynomial is changed.
 		"""
-		rv_coefs = self.coefs.copy()
-		for i in range(len(rv_coefs)):
-			rv_coefs[i] *= i
-		return Poly(*rv_coefs[1:])
+		coefs = self.coefs
+		for order in range(1, n + 1):
+			coefs = self._cached(('derivative', order),
+			                     lambda c=coefs: _scale(c, np.arange(len(c)))[1:])
+		if n < 1:
+			return Poly._from_coefs(coefs.copy())
+		return Poly._from_coefs(coefs, False)
 
 	def differentiate(self):
 		"""
 		Differentiates the polynomial object and reassigns
 		the value of the polynomial to the derivative.
 		"""
-		self.coefs = self.derivative().coefs
+		self._set(self.derivative().coefs, False)
 
 	def integral(self, c=0):
 		"""
@@ -105,18 +220,23 @@ class Poly:
 		returns it as a polynomial object. c is the constant of
 		integration and is set to 0 by default.
 		"""
-		rv_coefs = self.coefs.copy()
-		rv_coefs.insert(0, c)
-		for i in range(1, len(rv_coefs)):
-			rv_coefs[i] /= i
-		return Poly(*rv_coefs)
+		def compute():
+			rv_coefs = self.coefs / np.arange(1, len(self.coefs) + 1)
+			return np.array((c, *rv_coefs))
+		try:
+			return Poly._from_coefs(self._cached(('integral', c), compute),
+			                        False)
+		except TypeError:
+			# c is unhashable and cannot be used as a cache key
+			return Poly._from_coefs(compute())
 
 	def integrate(self, c=0):
 		"""
 		Alters the object by transforming it into it's integral
 		with integration constant c supplied in th e function.
 		"""
-		self.coefs = self.integral(c).coefs
+		integral = self.integral(c)
+		self._set(integral.coefs, integral._owner)
 
 	def degree(self):
 		"""
@@ -124,20 +244,21 @@ class Poly:
 		"""
 		return len(self.coefs) - 1
 
+	def to_sparse(self):
+		"""
+		Returns the polynomial as a SparsePoly object.
+		"""
+		return SparsePoly.from_poly(self)
+
 	def __add__(self, other):
 		"""
 		Defines addition (p + q) of polynomial p and polynomial q.
 		Returns a polynomial object that is the sum of the two
 		polynomials.
 		"""
-		num_self = len(self.coefs)
-		num_other = len(other.coefs)
-		if num_self > num_other:
-			other_coefs = other.coefs + [0]*(num_self-num_other)
-			return Poly(*[x+y for x, y in zip(self.coefs, other_coefs)])
-		else:
-			self_coefs = self.coefs + [0]*(num_other-num_self)
-			return Poly(*[x+y for x, y in zip(self_coefs, other.coefs)])
+		if isinstance(other, SparsePoly):
+			return NotImplemented
+		return Poly._from_coefs(_pad(self.coefs, other.coefs, np.add))
 
 	def __sub__(self, other):
 		"""
@@ -145,32 +266,148 @@ class Poly:
 		Returns a polynomial object that is the difference of the two
 		polynomials.
 		"""
-		num_self = len(self.coefs)
-		num_other = len(other.coefs)
-		if num_self > num_other:
-			other_coefs = other.coefs + [0] * (num_self - num_other)
-			return Poly(*[x - y for x, y in zip(self.coefs, other_coefs)])
-		else:
-			self_coefs = self.coefs + [0] * (num_other - num_self)
-			return Poly(*[x - y for x, y in zip(self_coefs, other.coefs)])
+		if isinstance(other, SparsePoly):
+			return NotImplemented
+		return Poly._from_coefs(_pad(self.coefs, other.coefs, np.subtract))
 
 	def __mul__(self, other):
 		"""
 		Defines multiplication (p*q) of polynomial p and polynomial q.
 		Returns a polynomial object that is the product of the two
-		polynomials.
+		polynomials. q may also be a scalar, as with *=.
 
-		Uses matrix multiplication to implement the algorithm for speed
-		and simplicity of implementation.
+		The algorithm is chosen by size in _multiply: direct convolution
+		for short polynomials, Karatsuba for medium ones and FFT for long
+		floating point ones. Integer and Fraction coefficients never go
+		through the FFT so their products stay exact.
 		"""
-		num_self = len(self.coefs)
-		num_other = len(other.coefs)
-		num_rows = num_self + num_other - 1
-		m = np.zeros((num_rows, num_self))
-		for col in range(num_self):
-			for i in range(num_other):
-				m[col+i, col] = other.coefs[i]
-		return Poly(*list(np.dot(m, np.array(self.coefs))))
+		if isinstance(other, Number):
+			return Poly._from_coefs(_scale(self.coefs, other))
+		if isinstance(other, SparsePoly):
+			return NotImplemented
+		return Poly._from_coefs(_multiply(self.coefs, other.coefs))
+
+	def __rmul__(self, other):
+		"""
+		Defines s*p for a scalar s.
+		"""
+		if isinstance(other, Number):
+			return Poly._from_coefs(_scale(self.coefs, other))
+		return NotImplemented
+
+	def __iadd__(self, other):
+		"""
+		Adds the polynomial other to this one in place. The existing
+		coefficient buffer is updated without reallocating when other is
+		no longer than this polynomial and the result keeps its dtype.
+		Arrays previously read from coefs see the change.
+		"""
+		return self._update(other, np.add)
+
+	def __isub__(self, other):
+		"""
+		Subtracts the polynomial other from this one in place, reusing
+		the coefficient buffer under the same conditions as +=.
+		"""
+		return self._update(other, np.subtract)
+
+	def __imul__(self, other):
+		"""
+		Multiplies this polynomial in place by a scalar or by another
+		polynomial. Scaling reuses the coefficient buffer when the dtype
+		is unchanged. A polynomial product has more coefficients than
+		either factor and always needs a new buffer.
+		"""
+		if isinstance(other, Number):
+			return self._update(other, np.multiply)
+		if isinstance(other, SparsePoly):
+			return NotImplemented
+		self._set(_multiply(self._coefs, other.coefs), True)
+		return self
+
+	def _update(self, other, op):
+		"""
+		Applies the elementwise operation op to the coefficients and
+		other, which is a scalar or a polynomial, writing into the current
+		coefficient buffer when it is safe to do so.
+		"""
+		if isinstance(other, SparsePoly):
+			return NotImplemented
+		operand = other if isinstance(other, Number) else other.coefs
+		coefs, operand = _widen(self._coefs, operand,
+		                        _product_bound if op is np.multiply
+		                        else _sum_bound)
+		fits = np.ndim(operand) == 0 or len(operand) <= len(coefs)
+		if self._owner and fits \
+				and np.result_type(coefs, operand) == coefs.dtype:
+			coefs.setflags(write=True)
+			target = coefs if np.ndim(operand) == 0 else coefs[:len(operand)]
+			op(target, operand, out=target)
+			self._set(coefs, True)
+		elif np.ndim(operand) == 0:
+			self._set(op(coefs, operand), True)
+		else:
+			self._set(_pad(coefs, operand, op), True)
+		return self
+
+	def __divmod__(self, other):
+		"""
+		Defines polynomial division with remainder, divmod(p, q). Returns
+		the quotient and remainder polynomials so that p = q*quotient +
+		remainder with the remainder of lower degree than q. Integer
+		coefficients are divided with true division as in integral,
+		except by a monic q, which keeps them exact integers, as Python
+		integers when they could overflow int64; Fraction coefficients
+		stay exact.
+
+		Long divisions use the reversed polynomial and a Newton
+		iteration for its power series inverse, which costs a few
+		multiplications instead of one step per quotient coefficient.
+		"""
+		quotient, remainder = _divmod(self.coefs, _dense_coefs(other))
+		return Poly._from_coefs(quotient), Poly._from_coefs(remainder)
+
+	def __floordiv__(self, other):
+		"""
+		Defines p // q as the quotient of divmod(p, q).
+		"""
+		return divmod(self, other)[0]
+
+	def __mod__(self, other):
+		"""
+		Defines p % q as the remainder of divmod(p, q).
+		"""
+		return divmod(self, other)[1]
+
+	def compose(self, other):
+		"""
+		Returns the polynomial p(q(x)) where p is this polynomial and q
+		is other.
+		"""
+		return compose(self, other)
+
+	def gcd(self, other, tol=1e-10):
+		"""
+		Returns the monic greatest common divisor of this polynomial and
+		other. See the module level gcd function.
+		"""
+		return gcd(self, other, tol)
+
+	def evaluate_many(self, points):
+		"""
+		Evaluates the polynomial at every value in points and returns
+		the values as an array, running Horner's scheme over all points
+		at once. Integer points and coefficients are evaluated with
+		exact Python integers when the values could overflow int64.
+
+		There is no subproduct tree evaluation: in floating point the
+		products of the (x - x_i) grow so large that the remainders lose
+		all precision, and with exact integers the growth of their
+		coefficients makes it several times slower than Horner's scheme
+		at every size measured, even with Newton division for its monic
+		divisors.
+		"""
+		return self._horner_array(np.asarray(points))
 
 	def scalar_multiply(self, s):
 		"""
@@ -178,32 +415,174 @@ class Poly:
 		returning a polynomial object representing s*p.
 		"""
 		if s == 0:
-			self.coefs = [0]
+			self.coefs = np.array([0])
 		else:
-			self.coefs = [s*c for c in self.coefs]
+			self.coefs = _scale(self.coefs, s)
 
-	def local_minimum(self, start_x, lr=0.01, num_iters=2500):
+	def local_minimum(self, start_x, lr=0.01, num_iters=2500, tol=0):
 		"""
 		Finds a local or global minimum if one exists using 1d
-		gradient descent.
+		gradient descent. The descent stops early once a step is no
+		larger than tol. See optimize() for a version with step size
+		control that reports the iteration count.
 		"""
 		derivative = self.derivative()
 		lm_x = start_x
 		for _ in range(num_iters):
-			lm_x = lm_x - lr*derivative(lm_x)
+			step = lr*derivative(lm_x)
+			if abs(step) <= tol:
+				break
+			lm_x = lm_x - step
 		return lm_x, self(lm_x)
 
-	def local_maximum(self, start_x, lr=0.01, num_iters=2500):
+	def local_maximum(self, start_x, lr=0.01, num_iters=2500, tol=0):
 		"""
 		Finds a local or global maximum if one exists using 1d
-		gradient ascent.
+		gradient ascent. The ascent stops early once a step is no
+		larger than tol. See optimize() for a version with step size
+		control that reports the iteration count.
 		"""
 		derivative = self.derivative()
 		lm_x = start_x
 		for _ in range(num_iters):
-			lm_x = lm_x + lr*derivative(lm_x)
+			step = lr*derivative(lm_x)
+			if abs(step) <= tol:
+				break
+			lm_x = lm_x + step
 		return lm_x, self(lm_x)
 
+	def optimize(self, start_x, maximize=False, lr=0.01, tol=1e-10,
+	             max_iters=2500, bounds=None):
+		"""
+		Runs gradient descent (or ascent when maximize is True) from
+		start_x until a step moves x by no more than tol relative to
+		max(1, |x|) or max_iters steps have been taken. A step that
+		would make the objective worse is halved until it does not, so
+		steep polynomials cannot make the iteration diverge. bounds is
+		an optional (a, b) interval that x is clipped to.
+
+		Returns an OptimizeResult with the final x, the polynomial value
+		there, the number of iterations used and whether the tolerance
+		was reached.
+		"""
+		sign = -1 if maximize else 1
+		derivative = self.derivative()
+		x = start_x
+		fx = sign * self(x)
+		for iteration in range(1, max_iters + 1):
+			step = lr * sign * derivative(x)
+			while True:
+				candidate = x - step
+				if bounds is not None:
+					candidate = min(max(candidate, bounds[0]), bounds[1])
+				f_candidate = sign * self(candidate)
+				if f_candidate <= fx or abs(step) <= tol:
+					break
+				step /= 2
+			moved = abs(candidate - x)
+			x, fx = candidate, f_candidate
+			if moved <= tol * max(1, abs(x)):
+				return OptimizeResult(x, self(x), iteration, True)
+		return OptimizeResult(x, self(x), max_iters, False)
+
+	def critical_points(self, bounds=None):
+		"""
+		Returns a sorted array of the real x where the derivative is
+		zero, found from the roots of the derivative. bounds is an
+		optional (a, b) interval that the points must lie in.
+		"""
+		points = _real_roots(self.derivative().roots())
+		if bounds is not None:
+			points = points[(points >= bounds[0]) & (points <= bounds[1])]
+		return points
+
+	def extrema(self, bounds=None):
+		"""
+		Returns a list of Extremum tuples (x, value, kind) for every
+		critical point, sorted by x. kind is 'minimum', 'maximum' or
+		'saddle' and is decided by the sign of the second derivative. When
+		the second derivative vanishes the sign of the derivative on each
+		side of the point is used instead. When bounds (a, b) is given
+		only critical points inside the interval are returned and the
+		end points are added, classified by the sign of the derivative.
+		"""
+		points = self.critical_points()
+		rv = [Extremum(x, self(x), kind)
+		      for x, kind in zip(points, self._classify(points))]
+		if bounds is not None:
+			rv = [e for e in rv if bounds[0] <= e.x <= bounds[1]]
+			points = [e.x for e in rv]
+			derivative = self.derivative()
+			for x, direction in ((bounds[0], 1), (bounds[1], -1)):
+				if x in points:
+					continue
+				slope = direction * derivative(x)
+				if slope > 0:
+					kind = 'minimum'
+				elif slope < 0:
+					kind = 'maximum'
+				else:
+					kind = 'saddle'
+				rv.append(Extremum(x, self(x), kind))
+			rv.sort(key=lambda extremum: extremum.x)
+		return rv
+
+	def global_minimum(self, bounds=None):
+		"""
+		Returns the Extremum with the smallest value on the interval
+		bounds, or on the whole real line when bounds is None. Raises
+		ValueError when the polynomial is unbounded below.
+		"""
+		return self._global_extremum(bounds, 1, 'minimum')
+
+	def global_maximum(self, bounds=None):
+		"""
+		Returns the Extremum with the largest value on the interval
+		bounds, or on the whole real line when bounds is None. Raises
+		ValueError when the polynomial is unbounded above.
+		"""
+		return self._global_extremum(bounds, -1, 'maximum')
+
+	def _global_extremum(self, bounds, sign, kind):
+		candidates = list(self.critical_points(bounds))
+		if bounds is None:
+			nonzero = np.flatnonzero(self.coefs)
+			degree = nonzero[-1] if len(nonzero) else 0
+			if degree % 2 or (degree and sign * self.coefs[degree] < 0):
+				raise ValueError('Polynomial has no global {}.'.format(kind))
+			if not candidates:
+				candidates = [0]
+		else:
+			candidates += list(bounds)
+		x = min(candidates, key=lambda c: sign * self(c))
+		return Extremum(x, self(x), kind)
+
+	def _classify(self, points):
+		"""
+		Classifies each of the sorted critical points as a 'minimum',
+		'maximum' or 'saddle'.
+		"""
+		derivative = self.derivative()
+		second = self.derivative(2)
+		kinds = []
+		for i, x in enumerate(points):
+			curvature = second(x)
+			if not _is_negligible(second, x, curvature):
+				kinds.append('minimum' if curvature > 0 else 'maximum')
+				continue
+
+			# probe the derivative halfway to the neighbouring points
+			left = (points[i - 1] + x) / 2 if i > 0 else x - 1
+			right = (x + points[i + 1]) / 2 if i + 1 < len(points) else x + 1
+			left_slope, right_slope = derivative(left), derivative(right)
+			if left_slope < 0 < right_slope:
+				kinds.append('minimum')
+			elif left_slope > 0 > right_slope:
+				kinds.append('maximum')
+			else:
+				kinds.append('saddle')
+		return kinds
+
 	def definite_integral(self, x1, x2):
 		"""
 		Calculates the definite integral of the polynomial between x1 and
@@ -217,19 +596,1095 @@ class Poly:
 		Implements Newton's method to find a root of the polynomial.
 		start_x is the intitial guess of the root and the algorithm
 		iterates from there using Newton's method num_iters number
-		of times.
+		of times, stopping early once an iteration no longer moves root_x.
+		Use roots() to find every root at once.
 		"""
 		root_x = start_x
 		derivative = self.derivative()
 		for _ in range(num_iters):
-			if derivative(root_x) == 0:
+			slope = derivative(root_x)
+			if slope == 0:
 				raise ZeroDivisionError('Derivative of polynomial evaluated '
 				                        'to zero at current iteration '
 				                        'producing division by zero in '
 				                        'Newton\'s method.')
-			root_x = root_x - self(root_x)/derivative(root_x)
+			next_x = root_x - self(root_x)/slope
+			if next_x == root_x:
+				break
+			root_x = next_x
 		return root_x, self(root_x)
 
+	def roots(self, polish_iters=3):
+		"""
+		Returns every real and complex root of the polynomial, repeated
+		according to multiplicity. The roots are the eigenvalues of the
+		companion matrix, refined with polish_iters vectorized Newton
+		steps. A real array is returned when all roots are real.
+		Constant polynomials have no roots and give an empty array.
+		"""
+		return _roots(np.atleast_2d(self.coefs), polish_iters)[0]
+
+	def compile(self, domain, method='chebyshev', tol=None, degree=8,
+	            pieces=None):
+		"""
+		Returns a CompiledPoly that evaluates the polynomial on the
+		interval domain = (a, b) from a precomputed Chebyshev
+		representation, which is better conditioned than the monomial
+		coefficients for high degrees.
+
+		method='chebyshev' expands the polynomial in Chebyshev
+		polynomials on the whole domain and drops the highest terms
+		whose coefficients add up to no more than tol.
+
+		method='piecewise' splits the domain into equal pieces and keeps a
+		Chebyshev expansion of the given degree on each piece, which is
+		much cheaper to evaluate than a high degree polynomial. When
+		pieces is None the number of pieces is doubled until the
+		truncation error is no more than tol.
+
+		tol defaults to a few units of rounding relative to the size of
+		the polynomial on the domain. The error_bound attribute of the
+		result bounds the truncation error plus an estimate of rounding
+		error.
+		"""
+		if method == 'chebyshev':
+			table = _chebyshev_pieces(self.coefs, domain, 1)
+			scale = np.abs(table).sum()
+			if tol is None:
+				tol = 8 * np.finfo(float).eps * scale
+			dropped = np.cumsum(np.abs(table[0, ::-1]))
+			keep = max(len(table[0]) - np.searchsorted(dropped, tol, 'right'), 1)
+			return CompiledPoly(domain, table[:, :keep], tol=tol,
+			                    truncation=dropped[-keep - 1]
+			                    if keep < len(table[0]) else 0.0)
+		if method == 'piecewise':
+			# The Taylor and Chebyshev matrices do not depend on the
+			# number of pieces, and only the Chebyshev coefficients past
+			# degree are needed to measure the truncation of each number.
+			taylor = _taylor_matrix(self.coefs)
+			basis = _chebyshev_basis(len(taylor))
+			if tol is None:
+				table = _piece_table(taylor, basis, domain, 1)
+				tol = 8 * np.finfo(float).eps * float(np.abs(table).sum())
+			count = pieces or 1
+			while True:
+				truncation = float(np.abs(_piece_table(
+					taylor, basis[:, degree + 1:], domain, count))
+					.sum(axis=1).max(initial=0.0))
+				if pieces is not None or truncation <= tol \
+						or count >= MAX_PIECES:
+					break
+				count *= 2
+			table = _piece_table(taylor, basis[:, :degree + 1], domain,
+			                     count).astype(float)
+			return CompiledPoly(domain, table, tol=tol,
+			                    truncation=truncation)
+		raise ValueError('Unknown compile method {}.'.format(method))
+
+
+class FrozenPoly(Poly):
+
+	"""
+	FrozenPoly is an immutable Poly. Its coefficients cannot be
+	reassigned, so the mutating methods differentiate, integrate and
+	scalar_multiply raise AttributeError, and the in-place operators
+	return a new polynomial instead of updating this one. Frozen
+	polynomials compare equal by their coefficients and are hashable, so
+	they can be used as dictionary keys and set members.
+
+	Arithmetic on frozen polynomials returns ordinary Poly objects; call
+	freeze() on a result to make it immutable without copying.
+	"""
+
+	__slots__ = ()
+
+	def _set(self, coefs, owner):
+		if hasattr(self, '_coefs') and coefs is not self._coefs:
+			raise AttributeError('FrozenPoly objects are immutable.')
+		super()._set(coefs, False)
+
+	def freeze(self):
+		return self
+
+	def __iadd__(self, other):
+		return self + other
+
+	def __isub__(self, other):
+		return self - other
+
+	def __imul__(self, other):
+		return self * other
+
+	def __eq__(self, other):
+		if not isinstance(other, Poly):
+			return NotImplemented
+		return len(self.coefs) == len(other.coefs) \
+		       and bool(np.all(self.coefs == other.coefs))
+
+	def __hash__(self):
+		return hash(tuple(self._coefs.tolist()))
+
+
+class PolyBatch:
+
+	"""
+	PolyBatch holds many polynomials in one padded 2-D coefficient array
+	so that evaluation and arithmetic run over the whole batch with a
+	handful of NumPy operations instead of one Python call per polynomial.
+
+	Row i of coefs holds the coefficients of polynomial i, lowest power
+	first, padded with zeros up to the widest polynomial in the batch.
+	lengths records the number of coefficients each polynomial would have
+	as a Poly so that converting back gives the same result as the
+	corresponding Poly method. As with Poly, integer results that could
+	overflow int64 are computed with exact Python integers.
+	"""
+
+	def __init__(self, coefs, lengths=None):
+		self.coefs = np.atleast_2d(np.asarray(coefs))
+		if lengths is None:
+			lengths = np.full(len(self.coefs), self.coefs.shape[1])
+		self.lengths = np.asarray(lengths)
+
+	@classmethod
+	def from_polys(cls, polys):
+		"""
+		Builds a batch from a sequence of Poly objects.
+		"""
+		lengths = np.array([len(p.coefs) for p in polys], dtype=int)
+		dtype = np.result_type(*[p.coefs for p in polys]) if len(polys) \
+			else np.int64
+		coefs = np.zeros((len(polys), lengths.max(initial=0)), dtype=dtype)
+		for i, p in enumerate(polys):
+			coefs[i, :len(p.coefs)] = p.coefs
+		return cls(coefs, lengths)
+
+	def to_polys(self):
+		"""
+		Returns the batch as a list of Poly objects.
+		"""
+		return [self[i] for i in range(len(self))]
+
+	def __len__(self):
+		return len(self.coefs)
+
+	def __getitem__(self, i):
+		return Poly(*self.coefs[i, :self.lengths[i]])
+
+	def __repr__(self):
+		return '{self.__class__.__name__}({n} polynomials, width {w})'.format(
+			self=self, n=len(self), w=self.coefs.shape[1])
+
+	def __call__(self, x):
+		"""
+		Evaluates every polynomial at x with Horner's scheme. For an
+		array x of shape s the result has shape (len(self),) + s and row i
+		holds the values of polynomial i.
+		"""
+		coefs, x = _widen(self.coefs, np.asarray(x),
+		                  lambda coefs, x: _horner_bound(coefs.T, x))
+		rv = np.zeros((len(self),) + x.shape,
+		              dtype=np.result_type(x, coefs))
+		column_shape = (len(self),) + (1,) * x.ndim
+		for col in coefs.T[::-1]:
+			rv *= x
+			rv += col.reshape(column_shape)
+		return rv
+
+	def degree(self):
+		"""
+		Returns an array with the degree of every polynomial.
+		"""
+		return self.lengths - 1
+
+	def _check_size(self, other):
+		if len(self) != len(other):
+			raise ValueError('Batches must contain the same number of '
+			                 'polynomials.')
+
+	def __add__(self, other):
+		"""
+		Adds the polynomials of two batches elementwise.
+		"""
+		self._check_size(other)
+		return PolyBatch(_pad_columns(self.coefs, other.coefs, np.add),
+		                 np.maximum(self.lengths, other.lengths))
+
+	def __sub__(self, other):
+		"""
+		Subtracts the polynomials of two batches elementwise.
+		"""
+		self._check_size(other)
+		return PolyBatch(_pad_columns(self.coefs, other.coefs, np.subtract),
+		                 np.maximum(self.lengths, other.lengths))
+
+	def __mul__(self, other):
+		"""
+		Multiplies the polynomials of two batches elementwise. The loop
+		runs once per column of other and each step updates the whole
+		batch.
+		"""
+		self._check_size(other)
+		width_self = self.coefs.shape[1]
+		width_other = other.coefs.shape[1]
+		a, b = _widen(self.coefs, other.coefs,
+		              lambda a, b: _product_bound(a, b)
+		              * min(width_self, width_other))
+		rv = np.zeros((len(self), max(width_self + width_other - 1, 0)),
+		              dtype=np.result_type(a, b))
+		for j in range(width_other):
+			rv[:, j:j + width_self] += a * b[:, j:j + 1]
+		return PolyBatch(rv, np.maximum(self.lengths + other.lengths - 1, 0))
+
+	def derivative(self):
+		"""
+		Returns a batch holding the derivative of every polynomial.
+		"""
+		powers = np.arange(1, self.coefs.shape[1])
+		return PolyBatch(_scale(self.coefs[:, 1:], powers),
+		                 np.maximum(self.lengths - 1, 0))
+
+	def integral(self, c=0):
+		"""
+		Returns a batch holding the integral of every polynomial. c is
+		the constant of integration and may be a scalar or one value
+		per polynomial.
+		"""
+		powers = np.arange(1, self.coefs.shape[1] + 1)
+		rv_coefs = self.coefs / powers
+		rv = np.zeros((len(self), rv_coefs.shape[1] + 1),
+		              dtype=np.result_type(rv_coefs, c))
+		rv[:, 0] = c
+		rv[:, 1:] = rv_coefs
+		return PolyBatch(rv, self.lengths + 1)
+
+	def roots(self, polish_iters=3):
+		"""
+		Returns a list with the roots of every polynomial, as returned by
+		Poly.roots. Polynomials of the same degree share one stacked
+		eigenvalue computation and one set of Newton steps.
+		"""
+		return _roots(self.coefs, polish_iters)
+
+
+class SparsePoly:
+
+	"""
+	SparsePoly represents a polynomial with few nonzero terms by a
+	dictionary mapping each power to its nonzero coefficient, so that
+	x^1000000 + 1 stores two terms rather than a million coefficients.
+	Evaluation, addition, multiplication, differentiation and integration
+	all cost time proportional to the number of terms instead of the
+	degree.
+
+	SparsePoly objects can be mixed with Poly objects in +, - and *.
+	The result of an operation is returned as a dense Poly when more
+	than DENSITY_THRESHOLD of its coefficients are nonzero and as a
+	SparsePoly otherwise.
+	"""
+
+	DENSITY_THRESHOLD = 0.1
+
+	def __init__(self, terms=None):
+		self.terms = {}
+		if terms is not None:
+			for power, c in terms.items():
+				if power < 0:
+					raise ValueError('Powers must be nonnegative, got '
+					                 '{}.'.format(power))
+				if c != 0:
+					self.terms[int(power)] = c
+
+	@classmethod
+	def from_poly(cls, poly):
+		"""
+		Returns the SparsePoly with the same coefficients as the Poly
+		object poly.
+		"""
+		powers = np.flatnonzero(poly.coefs)
+		return cls(dict(zip(powers.tolist(), poly.coefs[powers].tolist())))
+
+	def to_poly(self):
+		"""
+		Returns the polynomial as a dense Poly object.
+		"""
+		coefs = np.zeros(self.degree() + 1,
+		                 dtype=np.result_type(*self.terms.values(), 0))
+		for power, c in self.terms.items():
+			coefs[power] = c
+		return Poly(*coefs)
+
+	def density(self):
+		"""
+		Returns the fraction of the coefficients up to the degree that
+		are nonzero.
+		"""
+		return len(self.terms) / (self.degree() + 1)
+
+	def __call__(self, x):
+		"""
+		Calculates the polynomial function value at x, which may be a
+		scalar, a list or a NumPy array. The terms are visited from the
+		highest power down, Horner style, and each gap between
+		consecutive powers is bridged with exponentiation by squaring.
+		"""
+		if isinstance(x, (list, tuple)):
+			x = np.asarray(x)
+		rv = 0 * x
+		previous = None
+		for power in sorted(self.terms, reverse=True):
+			if previous is not None:
+				rv = rv * _power(x, previous - power)
+			rv = rv + self.terms[power]
+			previous = power
+		if previous:
+			rv = rv * _power(x, previous)
+		return rv
+
+	def __repr__(self):
+		"""
+		Method that returns the command necessary to recreate
+		the exact polynomial object.
+		"""
+		str_terms = ['{}: {}'.format(power, self.terms[power])
+		             for power in sorted(self.terms)]
+		return '{self.__class__.__name__}({{'.format(self=self) \
+		       + ', '.join(str_terms) + '})'
+
+	def __str__(self):
+		"""
+		Method that produces a readable text representation of
+		this polynomial object as a string, in the same format as Poly.
+		"""
+		terms = sorted(self.terms.items())
+		if not terms or terms[0][0] != 0:
+			terms.insert(0, (0, 0))
+		return _format_terms(terms)
+
+	def degree(self):
+		"""
+		Returns the degree of the polynomial.
+		"""
+		return max(self.terms, default=0)
+
+	def derivative(self):
+		"""
+		Returns the derivative of the polynomial.
+		"""
+		return _sparse_or_dense({power - 1: c * power
+		                         for power, c in self.terms.items() if power})
+
+	def integral(self, c=0):
+		"""
+		Returns the integral of the polynomial with constant of
+		integration c.
+		"""
+		terms = {power + 1: coef / (power + 1)
+		         for power, coef in self.terms.items()}
+		terms[0] = c
+		return _sparse_or_dense(terms)
+
+	def __add__(self, other):
+		terms = dict(self.terms)
+		for power, c in _terms_of(other).items():
+			terms[power] = terms.get(power, 0) + c
+		return _sparse_or_dense(terms)
+
+	__radd__ = __add__
+
+	def __neg__(self):
+		return SparsePoly({power: -c for power, c in self.terms.items()})
+
+	def __sub__(self, other):
+		return self + -SparsePoly(_terms_of(other))
+
+	def __rsub__(self, other):
+		return -self + other
+
+	def __mul__(self, other):
+		terms = {}
+		for power_other, c_other in _terms_of(other).items():
+			for power, c in self.terms.items():
+				key = power + power_other
+				terms[key] = terms.get(key, 0) + c * c_other
+		return _sparse_or_dense(terms)
+
+	__rmul__ = __mul__
+
+
+class CompiledPoly:
+
+	"""
+	CompiledPoly is the fast evaluator returned by Poly.compile. It holds
+	a table of Chebyshev coefficients, one row per piece of the domain,
+	and evaluates array inputs with a vectorized Clenshaw recurrence.
+
+	error_bound bounds the difference from the original polynomial
+	anywhere in the domain. It is the sum of the magnitudes of the
+	dropped Chebyshev coefficients, which is exact because every
+	Chebyshev polynomial is bounded by one on its interval, plus an
+	estimate of the rounding error of the recurrence.
+	"""
+
+	def __init__(self, domain, table, tol=0.0, truncation=0.0):
+		self.domain = (float(domain[0]), float(domain[1]))
+		self.table = np.ascontiguousarray(table)
+		self._columns = np.ascontiguousarray(self.table.T)
+		self.tol = tol
+		self.pieces, self.degree = len(table), table.shape[1] - 1
+		self.width = (self.domain[1] - self.domain[0]) / self.pieces
+		rounding = 4 * (self.degree + 1) * np.finfo(float).eps \
+		           * np.abs(self.table).sum(axis=1).max()
+		self.error_bound = truncation + rounding
+
+	def __repr__(self):
+		return '{self.__class__.__name__}(domain={self.domain}, ' \
+		       'pieces={self.pieces}, degree={self.degree}, ' \
+		       'error_bound={self.error_bound:.3g})'.format(self=self)
+
+	def __call__(self, x):
+		"""
+		Evaluates the compiled polynomial at x, which may be a scalar, a
+		list or a NumPy array with every value inside the domain.
+		"""
+		x = np.asarray(x, dtype=float)
+		a, b = self.domain
+		if np.any((x < a) | (x > b)):
+			raise ValueError('Input lies outside the compiled domain '
+			                 '{}.'.format(self.domain))
+
+		# work through the input in blocks that fit in cache
+		flat = x.reshape(-1)
+		rv = np.empty(flat.shape)
+		for start in range(0, len(flat), EVAL_BLOCK):
+			stop = start + EVAL_BLOCK
+			rv[start:stop] = self._clenshaw(flat[start:stop])
+		rv = rv.reshape(x.shape)
+		return rv[()] if rv.ndim == 0 else rv
+
+	def _clenshaw(self, x):
+		"""
+		Evaluates the table at the one dimensional array x with
+		Clenshaw's recurrence, rotating three buffers in place.
+		"""
+		a = self.domain[0]
+		if self.pieces == 1:
+			t = (x - a) * (2 / self.width) - 1
+			columns = self._columns[:, 0]
+		else:
+			# map every x to its piece and to t in [-1, 1] on that piece
+			position = (x - a) / self.width
+			piece = np.minimum(position.astype(np.intp), self.pieces - 1)
+			t = 2 * (position - piece) - 1
+			columns = [column.take(piece) for column in self._columns]
+		two_t = 2 * t
+
+		b1 = np.zeros(x.shape)
+		b2 = np.zeros(x.shape)
+		b0 = np.empty(x.shape)
+		for k in range(self.degree, 0, -1):
+			np.multiply(two_t, b1, out=b0)
+			b0 -= b2
+			b0 += columns[k]
+			b0, b1, b2 = b2, b0, b1
+		t *= b1
+		t -= b2
+		t += columns[0]
+		return t
+
+
+def _chebyshev_pieces(coefs, domain, pieces):
+	"""
+	Returns a (pieces, len(coefs)) array whose row i holds the Chebyshev
+	coefficients of the polynomial with monomial coefficients coefs on
+	the i-th of pieces equal parts of domain.
+	"""
+	taylor = _taylor_matrix(coefs)
+	basis = _chebyshev_basis(len(taylor))
+	return _piece_table(taylor, basis, domain, pieces).astype(float)
+
+
+def _piece_table(taylor, basis, domain, pieces):
+	"""
+	Returns the extended precision Chebyshev coefficients, in the columns
+	of basis, of the polynomial with the _taylor_matrix taylor on each of
+	pieces equal parts of domain. The coefficients in the variable t,
+	where x = mid + half * t maps [-1, 1] onto a piece, are the Taylor
+	coefficients at mid times powers of half, which is the same for every
+	piece, so the whole table is two matrix products.
+	"""
+	n = len(taylor)
+	edges = np.linspace(domain[0], domain[1], pieces + 1,
+	                    dtype=np.longdouble)
+	mid = (edges[:-1] + edges[1:]) / 2
+	half = (edges[1] - edges[0]) / 2
+	powers = np.arange(n)
+	return (mid[:, None] ** powers) @ ((taylor * half ** powers) @ basis)
+
+
+def _taylor_matrix(coefs):
+	"""
+	Returns the extended precision (n, n) array whose entry (e, k) is
+	binomial(e + k, k) * coefs[e + k], so that the powers of m times its
+	column k give the k-th Taylor coefficient at m of the polynomial with
+	monomial coefficients coefs.
+	"""
+	coefs = np.asarray(coefs, dtype=np.longdouble)
+	if len(coefs) == 0:
+		coefs = np.zeros(1, dtype=np.longdouble)
+	n = len(coefs)
+	binomial = np.zeros((n, n), dtype=np.longdouble)
+	binomial[:, 0] = 1
+	for j in range(1, n):
+		binomial[j, 1:j + 1] = binomial[j - 1, :j] + binomial[j - 1, 1:j + 1]
+	taylor = np.zeros((n, n), dtype=np.longdouble)
+	for k in range(n):
+		taylor[:n - k, k] = binomial[k:, k] * coefs[k:]
+	return taylor
+
+
+def _chebyshev_basis(n):
+	"""
+	Returns the extended precision (n, n) array whose row k holds the
+	Chebyshev coefficients of x**k, so that monomial coefficients times
+	it are Chebyshev coefficients. Each row is x times the one before,
+	with x*T_0 = T_1 and x*T_j = (T_{j-1} + T_{j+1}) / 2.
+	"""
+	basis = np.zeros((n, n), dtype=np.longdouble)
+	basis[0, 0] = 1
+	for k in range(1, n):
+		previous = basis[k - 1, :k]
+		basis[k, 1:k + 1] = previous / 2
+		basis[k, :k - 1] += previous[1:] / 2
+		basis[k, 1] += previous[0] / 2
+	return basis
+
+
+def compose(p, q):
+	"""
+	Returns the composition p(q(x)) of the polynomials p and q.
+
+	The coefficients of p are split in halves recursively, so that
+	p(q) = low(q) + q^k * high(q), using the repeated squares q, q^2,
+	q^4, ... of q. Compared with Horner's scheme in q this replaces n
+	large polynomial products by a logarithmic number of levels of
+	products that fast multiplication handles well.
+	"""
+	coefs, inner = p.coefs, _dense_coefs(q)
+	if len(coefs) == 0:
+		return Poly._from_coefs(np.zeros(0, dtype=coefs.dtype))
+
+	squares = [inner]
+	while (1 << len(squares)) < len(coefs):
+		squares.append(_multiply(squares[-1], squares[-1]))
+
+	def compose_part(part):
+		if len(part) <= COMPOSE_LEAF:
+			rv = part[-1:]
+			for c in part[-2::-1]:
+				rv = _pad(_multiply(rv, inner), np.array([c]), np.add)
+			return rv
+		level = (len(part) - 1).bit_length() - 1
+		split = 1 << level
+		return _pad(compose_part(part[:split]),
+		            _multiply(compose_part(part[split:]), squares[level]),
+		            np.add)
+
+	return Poly._from_coefs(compose_part(coefs))
+
+
+def gcd(p, q, tol=1e-10):
+	"""
+	Returns the monic greatest common divisor of the polynomials p and q
+	found with Euclid's algorithm. Integer coefficients are converted to
+	Fractions, since dividing them by a divisor that is not monic would
+	otherwise give floating point remainders, and Fraction coefficients
+	are handled exactly, giving a gcd with Fraction coefficients. For
+	floating point coefficients a remainder coefficient no larger than
+	tol times the largest coefficient of the dividend counts as zero,
+	since rounding error would otherwise leave the remainders of common
+	factors slightly nonzero.
+	"""
+	a, b = _trim(p.coefs), _trim(_dense_coefs(q))
+	exact = np.result_type(a, b).kind in 'iubO'
+	if exact:
+		a, b = _fractions(a), _fractions(b)
+	if len(a) < len(b):
+		a, b = b, a
+	if len(a) == 0:
+		raise ValueError('The gcd of two zero polynomials is undefined.')
+	while len(b):
+		remainder = _divmod(a, b)[1]
+		if not exact:
+			remainder = _trim(remainder,
+			                  tol * np.abs(a).max() if len(a) else 0)
+		a, b = b, _trim(remainder)
+	return Poly._from_coefs(a / a[-1] if a[-1] != 1 else a.copy())
+
+
+def _fractions(coefs):
+	"""
+	Returns the coefficient array coefs with its integers converted to
+	Fractions, as an object array.
+	"""
+	return np.array([Fraction(c) if isinstance(c, Integral) else c
+	                 for c in coefs.tolist()], dtype=object)
+
+
+def _terms_of(poly):
+	"""
+	Returns the {power: coefficient} dictionary of a Poly or SparsePoly.
+	"""
+	if isinstance(poly, SparsePoly):
+		return poly.terms
+	return SparsePoly.from_poly(poly).terms
+
+
+def _sparse_or_dense(terms):
+	"""
+	Builds a SparsePoly from terms and converts it to a dense Poly when
+	its density exceeds SparsePoly.DENSITY_THRESHOLD.
+	"""
+	rv = SparsePoly(terms)
+	if rv.density() > SparsePoly.DENSITY_THRESHOLD:
+		return rv.to_poly()
+	return rv
+
+
+def _power(x, n):
+	"""
+	Returns x ** n for a non-negative integer n using exponentiation by
+	squaring, which works for scalars and elementwise on arrays.
+	"""
+	rv = 1
+	while n:
+		if n & 1:
+			rv = rv * x
+		n >>= 1
+		if n:
+			x = x * x
+	return rv
+
+
+def _format_terms(terms):
+	"""
+	Formats the (power, coefficient) pairs in terms, sorted by power, as
+	a readable polynomial string. The constant term is always printed and
+	other terms with a zero coefficient are skipped.
+	"""
+
+	# print format options
+	plus = ' + '
+	minus = ' - '
+	x_power_str = '^'
+	x_str = 'x'
+
+	rstr = ''
+	for i, c in terms:
+
+		# get coefficient and create coefficient string
+		if abs(c) == 1:
+			coef_str = ''
+		else:
+			coef_str = str(abs(c))
+
+		# concatenate each polynomial term to rstr
+		if i == 0:
+			rstr += str(c)
+		elif i == 1:
+			if c == 0:
+				pass
+			elif c < 0:
+				rstr += minus + coef_str + x_str
+			else:
+				rstr += plus + coef_str + x_str
+		else:
+			if c == 0:
+				pass
+			elif c < 0:
+				rstr += minus + coef_str + x_str + x_power_str + str(i)
+			else:
+				rstr += plus + coef_str + x_str + x_power_str + str(i)
+
+	return rstr
+
+
+def _multiply(a, b):
+	"""
+	Returns the coefficients of the product of the polynomials with
+	coefficient arrays a and b.
+	"""
+	if len(a) == 0 or len(b) == 0:
+		return np.zeros(0, dtype=np.result_type(a, b))
+	shorter = min(len(a), len(b))
+	a, b = _widen(a, b, lambda a, b: _product_sum_bound(a, b, shorter))
+	kind = np.result_type(a, b).kind
+	if kind in 'fc' and shorter >= FFT_CUTOFF:
+		return _fft_multiply(a, b)
+	if shorter <= CONVOLVE_CUTOFF.get(kind, CONVOLVE_CUTOFF['f']):
+		return np.convolve(a, b)
+	return _karatsuba(a, b)
+
+
+def _product_sum_bound(a, b, shorter):
+	"""
+	Returns an upper limit on the magnitude of the coefficients of the
+	product of the integer arrays a and b, and of the intermediate sums
+	_karatsuba forms on the way to them, when the shorter array has
+	shorter coefficients.
+	"""
+	bound = _product_bound(a, b) * shorter
+	if shorter > CONVOLVE_CUTOFF['i']:
+		# each level of Karatsuba adds the halves of its operands,
+		# doubling their magnitude while halving the length
+		bound *= shorter
+	return bound
+
+
+def _karatsuba(a, b):
+	"""
+	Multiplies the coefficient arrays a and b with Karatsuba's algorithm,
+	which replaces the four half size products of the schoolbook method
+	with three. Only additions, subtractions and multiplications are used
+	so Python integer and Fraction coefficients stay exact; _multiply
+	makes sure machine integers cannot overflow first.
+	"""
+	if len(a) < len(b):
+		a, b = b, a
+	n, m = len(a), len(b)
+	if m <= CONVOLVE_CUTOFF.get(np.result_type(a, b).kind,
+	                            CONVOLVE_CUTOFF['f']):
+		return np.convolve(a, b)
+
+	rv = np.zeros(n + m - 1, dtype=np.result_type(a, b))
+
+	# split a long operand into blocks the size of the short one
+	if n >= 2 * m:
+		for start in range(0, n, m):
+			block = _karatsuba(a[start:start + m], b)
+			rv[start:start + len(block)] += block
+		return rv
+
+	k = n // 2
+	a_low, a_high = a[:k], a[k:]
+	b_low, b_high = b[:k], b[k:]
+	z_low = _karatsuba(a_low, b_low)
+	z_high = _karatsuba(a_high, b_high)
+	z_mid = _karatsuba(_pad(a_low, a_high, np.add),
+	                   _pad(b_low, b_high, np.add))
+	z_mid[:len(z_low)] -= z_low
+	z_mid[:len(z_high)] -= z_high
+
+	rv[:len(z_low)] += z_low
+	rv[k:k + len(z_mid)] += z_mid[:n + m - 1 - k]
+	rv[2 * k:2 * k + len(z_high)] += z_high
+	return rv
+
+
+def _fft_multiply(a, b):
+	"""
+	Multiplies the floating point coefficient arrays a and b by pointwise
+	multiplication of their discrete Fourier transforms.
+	"""
+	size = len(a) + len(b) - 1
+	fft_size = 1 << (size - 1).bit_length()
+	if np.iscomplexobj(a) or np.iscomplexobj(b):
+		return np.fft.ifft(np.fft.fft(a, fft_size)
+		                   * np.fft.fft(b, fft_size))[:size]
+	return np.fft.irfft(np.fft.rfft(a, fft_size)
+	                    * np.fft.rfft(b, fft_size), fft_size)[:size]
+
+
+def _roots(coefs, polish_iters):
+	"""
+	Finds the roots of every row of the 2-D coefficient array coefs.
+	Rows are grouped by degree after stripping zero coefficients at both
+	ends, and each group is solved with one batched call to
+	np.linalg.eigvals on the stacked companion matrices.
+	"""
+	dtype = complex if np.iscomplexobj(coefs) else float
+	coefs = np.asarray(coefs, dtype=dtype)
+	if coefs.shape[1] == 0:
+		return [np.zeros(0) for _ in coefs]
+	nonzero = coefs != 0
+	width = coefs.shape[1]
+	low = np.argmax(nonzero, axis=1)
+	high = width - 1 - np.argmax(nonzero[:, ::-1], axis=1)
+	degrees = np.where(nonzero.any(axis=1), high - low, 0)
+
+	rv = [None] * len(coefs)
+	for degree in np.unique(degrees):
+		rows = np.flatnonzero(degrees == degree)
+		group = coefs[rows[:, None], low[rows, None] + np.arange(degree + 1)]
+		found = _companion_roots(group, polish_iters)
+		for row, row_roots in zip(rows, found):
+			zero_roots = np.zeros(low[row] if nonzero[row].any() else 0)
+			row_roots = np.sort_complex(np.concatenate((row_roots, zero_roots)))
+			if dtype is float:
+				row_roots = np.real_if_close(row_roots, tol=1000)
+			rv[row] = row_roots
+	return rv
+
+
+def _companion_roots(group, polish_iters):
+	"""
+	Returns the roots of each row of group, a 2-D array of polynomials
+	that all have the same degree and nonzero constant and leading
+	coefficients.
+	"""
+	count, degree = group.shape[0], group.shape[1] - 1
+	if degree == 0:
+		return np.zeros((count, 0), dtype=complex)
+	companion = np.zeros((count, degree, degree), dtype=group.dtype)
+	companion[:, np.arange(1, degree), np.arange(degree - 1)] = 1
+	companion[:, :, -1] = -group[:, :-1] / group[:, -1:]
+	z = np.linalg.eigvals(companion).astype(complex)
+
+	# vectorized Newton polishing, keeping a step only if it reduces
+	# the residual so that multiple roots do not drift away
+	derivative = group[:, 1:] * np.arange(1, degree + 1)
+	for _ in range(polish_iters):
+		value = _horner_rows(group, z)
+		slope = _horner_rows(derivative, z)
+		usable = slope != 0
+		step = np.where(usable, value / np.where(usable, slope, 1), 0)
+		candidate = z - step
+		improved = np.abs(_horner_rows(group, candidate)) < np.abs(value)
+		z = np.where(improved, candidate, z)
+	return z
+
+
+def _real_roots(roots):
+	"""
+	Returns the sorted real parts of the roots whose imaginary part is
+	negligible, merging roots that agree to within ROOT_TOL into their
+	mean.
+	"""
+	scale = np.maximum(1, np.abs(roots))
+	real = np.sort(np.real(roots[np.abs(np.imag(roots)) <= ROOT_TOL * scale]))
+	clusters = []
+	for x in real:
+		if clusters and x - clusters[-1][-1] <= ROOT_TOL * max(1, abs(x)):
+			clusters[-1].append(x)
+		else:
+			clusters.append([x])
+	return np.array([np.mean(cluster) for cluster in clusters])
+
+
+def _is_negligible(poly, x, value):
+	"""
+	Returns True when value = poly(x) is no larger than the rounding
+	error expected when evaluating poly at x.
+	"""
+	scale = Poly(*np.abs(poly.coefs))(abs(x))
+	return abs(value) <= 1e-9 * scale
+
+
+def _horner_rows(coefs, z):
+	"""
+	Evaluates the polynomial in row i of coefs at every point in row i
+	of z.
+	"""
+	rv = np.zeros(z.shape, dtype=np.result_type(coefs, z))
+	for col in coefs.T[::-1]:
+		rv *= z
+		rv += col[:, None]
+	return rv
+
+
+def _dense_coefs(poly):
+	"""
+	Returns the dense coefficient array of a Poly or SparsePoly.
+	"""
+	if isinstance(poly, SparsePoly):
+		return poly.to_poly().coefs
+	return poly.coefs
+
+
+def _trim(coefs, tol=0):
+	"""
+	Returns coefs without the trailing coefficients, those of the
+	highest powers, whose magnitude is no larger than tol.
+	"""
+	significant = np.flatnonzero(np.abs(coefs) > tol) if len(coefs) else ()
+	return coefs[:significant[-1] + 1] if len(significant) else coefs[:0]
+
+
+def _divide(x, lead):
+	# monic divisors leave exact integer coefficients exact
+	return x if lead == 1 else x / lead
+
+
+def _divmod(a, b):
+	"""
+	Returns the quotient and remainder coefficient arrays of the
+	division of a by b.
+	"""
+	a, b = _trim(a), _trim(b)
+	if len(b) == 0:
+		raise ZeroDivisionError('Polynomial division by zero.')
+	if b[-1] == 1:
+		a, b = _widen(a, b, _division_bound)
+		dtype = np.result_type(a, b)
+	else:
+		dtype = np.result_type(a, b, 1.0)
+	if len(a) < len(b):
+		return np.zeros(1, dtype=dtype), _nonempty(a.astype(dtype))
+	if dtype.kind in 'fc' \
+			and min(len(a) - len(b) + 1, len(b)) >= DIVISION_CUTOFF:
+		quotient, remainder = _fast_divmod(a, b)
+	else:
+		quotient, remainder = _schoolbook_divmod(a.astype(dtype), b)
+	return quotient, _nonempty(_trim(remainder))
+
+
+def _nonempty(coefs):
+	return coefs if len(coefs) else np.zeros(1, dtype=coefs.dtype)
+
+
+def _schoolbook_divmod(a, b):
+	"""
+	Long division of a by b, one quotient coefficient at a time.
+	"""
+	m = len(b)
+	remainder = a.copy()
+	quotient = np.zeros(len(a) - m + 1, dtype=a.dtype)
+	for k in range(len(quotient) - 1, -1, -1):
+		quotient[k] = _divide(remainder[k + m - 1], b[-1])
+		remainder[k:k + m] -= quotient[k] * b
+	return quotient, remainder[:m - 1]
+
+
+def _fast_divmod(a, b):
+	"""
+	Divides a by b through the reversed polynomials: the reversed
+	quotient is the reversed dividend times the power series inverse of
+	the reversed divisor, truncated to the length of the quotient.
+	"""
+	length = len(a) - len(b) + 1
+	inverse = _series_inverse(b[::-1], length)
+	quotient = _multiply(a[::-1][:length], inverse)[:length][::-1]
+	remainder = _pad(a, _multiply(b, quotient), np.subtract)[:len(b) - 1]
+	return quotient, remainder
+
+
+def _series_inverse(f, length):
+	"""
+	Returns the first length coefficients of the power series 1/f with
+	Newton's iteration g <- g * (2 - f*g), which doubles the number of
+	correct coefficients at every step.
+	"""
+	g = np.array([_divide(1, f[0])])
+	precision = 1
+	while precision < length:
+		precision = min(2 * precision, length)
+		error = -_multiply(f[:precision], g)[:precision]
+		error[0] += 2
+		g = _multiply(g, error)[:precision]
+	return g
+
+
+def _coef_array(value):
+	"""
+	Returns the coefficient array for the sequence value. Python
+	integers outside the range of int64, which NumPy would store as
+	unsigned, floating point or object values depending on their
+	neighbours, are all kept exact in an object array.
+	"""
+	coefs = np.array(value)
+	if coefs.dtype.kind in 'uf' and not isinstance(value, np.ndarray):
+		ints = [c for c in value if isinstance(c, int)]
+		if len(ints) == len(value) \
+				and max(map(abs, ints), default=0) > INT_MAX:
+			coefs = np.array(value, dtype=object)
+	return coefs
+
+
+def _max_abs(x):
+	"""
+	Returns the largest magnitude in the integer array or scalar x as a
+	Python int, which cannot overflow.
+	"""
+	x = np.asarray(x)
+	if x.size == 0:
+		return 0
+	return max(int(x.max()), -int(x.min()))
+
+
+def _sum_bound(a, b):
+	return _max_abs(a) + _max_abs(b)
+
+
+def _product_bound(a, b):
+	return _max_abs(a) * _max_abs(b)
+
+
+def _horner_bound(coefs, x):
+	"""
+	Returns a power of two bounding the magnitude of the values Horner's
+	scheme computes for the integer coefficients coefs at the integer
+	points x.
+	"""
+	return 1 << (_max_abs(coefs).bit_length() + len(coefs).bit_length()
+	             + max(len(coefs) - 1, 0) * _max_abs(x).bit_length())
+
+
+def _division_bound(a, b):
+	"""
+	Returns a power of two bounding the magnitude of the quotient and
+	remainder coefficients long division of the integer coefficients a by
+	the monic b computes, which can grow by a factor of 1 + max|b| with
+	every quotient coefficient.
+	"""
+	steps = max(len(a) - len(b) + 1, 0)
+	return 1 << (_max_abs(a).bit_length()
+	             + steps * (_max_abs(b) + 1).bit_length())
+
+
+def _widen(a, b, bound):
+	"""
+	Returns a and b, or both as object arrays of Python integers when
+	they hold machine integers and bound(a, b), an upper limit on the
+	magnitude of the results computed from them, exceeds INT_MAX.
+	"""
+	if np.result_type(a, b).kind not in 'iu' or bound(a, b) <= INT_MAX:
+		return a, b
+	return np.asarray(a).astype(object), np.asarray(b).astype(object)
+
+
+def _scale(a, b):
+	"""
+	Returns the elementwise product of a and b, exact for integers.
+	"""
+	a, b = _widen(a, b, _product_bound)
+	return a * b
+
+
+def _pad(a, b, op):
+	"""
+	Applies the elementwise operation op, an addition or subtraction, to
+	the coefficient arrays a and b after padding the shorter one with
+	zeros.
+	"""
+	a, b = _widen(a, b, _sum_bound)
+	rv = np.zeros(max(len(a), len(b)), dtype=np.result_type(a, b))
+	rv[:len(a)] = a
+	op(rv[:len(b)], b, out=rv[:len(b)])
+	return rv
+
+
+def _pad_columns(a, b, op):
+	"""
+	Applies the elementwise operation op to the 2-D coefficient arrays a
+	and b after padding the narrower one with zero columns.
+	"""
+	a, b = _widen(a, b, _sum_bound)
+	rv = np.zeros((len(a), max(a.shape[1], b.shape[1])),
+	              dtype=np.result_type(a, b))
+	rv[:, :a.shape[1]] = a
+	op(rv[:, :b.shape[1]], b, out=rv[:, :b.shape[1]])
+	return rv
+
 
 if __name__ == '__main__':
 
@@ -0,0 +1,430 @@
+"""
+Benchmarks for the Poly class in polynomial.py. Each benchmark times the
+current implementation against a straightforward pure Python reference
+so the speed up of each change can be checked on the local machine.
+
+Run the module directly to print every benchmark:
+
+	python polynomial_benchmarks.py
+"""
+
+import timeit
+import tracemalloc
+from fractions import Fraction
+
+import numpy as np
+
+import polynomial
+from polynomial import Poly, PolyBatch, SparsePoly, compose
+
+
+def _report(name, reference_time, new_time):
+	print('{:<40} reference {:>10.4f}s  new {:>10.4f}s  speed up {:>8.1f}x'
+	      .format(name, reference_time, new_time, reference_time / new_time))
+
+
+def _loop_call(coefs, x):
+	"""
+	Reference evaluation that mirrors the original Poly.__call__ which
+	recomputed x ** i for every term.
+	"""
+	rv = 0
+	for i in range(len(coefs)):
+		rv += coefs[i] * (x ** i)
+	return rv
+
+
+def benchmark_call(grid_size=1000000, degree=10, number=3):
+	"""
+	Times evaluation of a single polynomial on a large grid with
+	Horner's scheme against the per term power loop.
+	"""
+	coefs = np.random.default_rng(0).uniform(-1, 1, degree + 1).tolist()
+	p = Poly(*coefs)
+	x = np.linspace(-1, 1, grid_size)
+	assert np.allclose(p(x), _loop_call(coefs, x))
+	reference_time = timeit.timeit(lambda: _loop_call(coefs, x), number=number)
+	new_time = timeit.timeit(lambda: p(x), number=number)
+	_report('__call__ ndarray ({} points)'.format(grid_size),
+	        reference_time, new_time)
+
+	scalar_points = x[:10000].tolist()
+	reference_time = timeit.timeit(
+		lambda: [_loop_call(coefs, xi) for xi in scalar_points], number=number)
+	new_time = timeit.timeit(
+		lambda: [p(xi) for xi in scalar_points], number=number)
+	_report('__call__ scalar ({} calls)'.format(len(scalar_points)),
+	        reference_time, new_time)
+
+
+def benchmark_batch(num_polys=10000, degree=5, grid_size=100, number=3):
+	"""
+	Times evaluation, addition and differentiation of many small
+	polynomials held in a PolyBatch against the per Poly methods.
+	"""
+	rng = np.random.default_rng(0)
+	ps = [Poly(*rng.uniform(-1, 1, degree + 1)) for _ in range(num_polys)]
+	qs = [Poly(*rng.uniform(-1, 1, degree + 1)) for _ in range(num_polys)]
+	batch_p = PolyBatch.from_polys(ps)
+	batch_q = PolyBatch.from_polys(qs)
+	x = np.linspace(-1, 1, grid_size)
+	assert np.allclose(batch_p(x), [p(x) for p in ps])
+
+	reference_time = timeit.timeit(lambda: [p(x) for p in ps], number=number)
+	new_time = timeit.timeit(lambda: batch_p(x), number=number)
+	_report('PolyBatch __call__ ({} polys)'.format(num_polys),
+	        reference_time, new_time)
+
+	reference_time = timeit.timeit(
+		lambda: [p + q for p, q in zip(ps, qs)], number=number)
+	new_time = timeit.timeit(lambda: batch_p + batch_q, number=number)
+	_report('PolyBatch __add__ ({} polys)'.format(num_polys),
+	        reference_time, new_time)
+
+	reference_time = timeit.timeit(
+		lambda: [p.derivative() for p in ps], number=number)
+	new_time = timeit.timeit(batch_p.derivative, number=number)
+	_report('PolyBatch derivative ({} polys)'.format(num_polys),
+	        reference_time, new_time)
+
+
+def _matrix_multiply(a, b):
+	"""
+	Reference product that mirrors the original Poly.__mul__ which built
+	a dense Toeplitz matrix with a double Python loop.
+	"""
+	m = np.zeros((len(a) + len(b) - 1, len(a)))
+	for col in range(len(a)):
+		for i in range(len(b)):
+			m[col + i, col] = b[i]
+	return np.dot(m, a)
+
+
+def _best_time(func, number):
+	return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def benchmark_multiply(sizes=(10, 100, 1000), number=3):
+	"""
+	Times Poly.__mul__ against the dense matrix product for polynomials
+	with the given numbers of coefficients, and checks that integer
+	products too large for int64 come out exact.
+	"""
+	rng = np.random.default_rng(0)
+	for size in sizes:
+		p = Poly(*rng.uniform(-1, 1, size))
+		q = Poly(*rng.uniform(-1, 1, size))
+		assert np.allclose((p * q).coefs, _matrix_multiply(p.coefs, q.coefs))
+		reference_time = timeit.timeit(
+			lambda: _matrix_multiply(p.coefs, q.coefs), number=number)
+		new_time = timeit.timeit(lambda: p * q, number=number)
+		_report('__mul__ ({} coefficients)'.format(size),
+		        reference_time, new_time)
+
+	# integer products that would overflow int64 are computed exactly
+	assert (Poly(2**40) * Poly(2**40)).coefs.tolist() == [2**80]
+	for size in sizes:
+		coefs = rng.integers(-2**40, 2**40, size)
+		p = Poly(*coefs)
+		exact = np.convolve(coefs.astype(object), coefs.astype(object))
+		assert (p * p).coefs.tolist() == exact.tolist()
+
+
+def benchmark_multiply_crossover(sizes=(16, 32, 64, 128, 256, 512, 1024,
+                                        2048, 4096, 8192)):
+	"""
+	Prints the time per product of each multiplication algorithm for
+	float, integer and Fraction coefficients. The crossover points in
+	polynomial.CONVOLVE_CUTOFF and polynomial.FFT_CUTOFF are read off
+	this table.
+	"""
+	rng = np.random.default_rng(0)
+	print('{:>6} {:>6} {:>12} {:>12} {:>12}'.format(
+		'kind', 'size', 'convolve', 'karatsuba', 'fft'))
+	for kind in ('f', 'i', 'O'):
+		for size in sizes:
+			if kind == 'f':
+				a, b = rng.uniform(-1, 1, (2, size))
+			elif kind == 'i':
+				a, b = rng.integers(-100, 100, (2, size))
+			else:
+				if size > 256:
+					continue
+				a, b = (np.array([Fraction(int(v), 7) for v in row])
+				        for row in rng.integers(-100, 100, (2, size)))
+			number = 1 if kind == 'O' else 5
+			times = [_best_time(lambda: np.convolve(a, b), number),
+			         _best_time(lambda: polynomial._karatsuba(a, b), number)]
+			if kind == 'f':
+				times.append(_best_time(
+					lambda: polynomial._fft_multiply(a, b), number))
+			print('{:>6} {:>6} '.format(kind, size)
+			      + ' '.join('{:>12.6f}'.format(t) for t in times))
+
+
+def benchmark_roots(num_polys=2000, degree=4, number=1):
+	"""
+	Times finding every root of many polynomials with PolyBatch.roots
+	against one Poly.roots call per polynomial, and a single Poly.roots
+	call against a fixed 2500 step Newton iteration for one real root.
+	"""
+	rng = np.random.default_rng(0)
+	ps = [Poly(*rng.uniform(-1, 1, degree + 1)) for _ in range(num_polys)]
+	batch = PolyBatch.from_polys(ps)
+
+	reference_time = timeit.timeit(lambda: [p.roots() for p in ps],
+	                               number=number)
+	new_time = timeit.timeit(batch.roots, number=number)
+	_report('PolyBatch roots ({} polys)'.format(num_polys),
+	        reference_time, new_time)
+
+	p = Poly(-6, 11, -6, 1)
+
+	def newton():
+		root_x = 0.0
+		derivative = p.derivative()
+		for _ in range(2500):
+			root_x = root_x - p(root_x) / derivative(root_x)
+		return root_x
+
+	reference_time = timeit.timeit(newton, number=number)
+	new_time = timeit.timeit(p.roots, number=number)
+	_report('roots vs 2500 Newton steps', reference_time, new_time)
+
+
+def benchmark_extrema(number=20):
+	"""
+	Times finding every extremum with Poly.extrema and a single minimum
+	with Poly.optimize against the fixed 2500 step local_minimum.
+	"""
+	p = Poly(0, 0, -2, 0, 1)
+	reference_time = timeit.timeit(lambda: p.local_minimum(0.3), number=number)
+	new_time = timeit.timeit(p.extrema, number=number)
+	_report('extrema vs local_minimum', reference_time, new_time)
+	new_time = timeit.timeit(lambda: p.optimize(0.3), number=number)
+	_report('optimize vs local_minimum', reference_time, new_time)
+
+
+def benchmark_sparse(degree=1000000, number=3):
+	"""
+	Times evaluation, differentiation, addition and printing of
+	x^degree + 1 stored as a SparsePoly against the dense Poly.
+	"""
+	sparse = SparsePoly({degree: 1.0, 0: 1.0})
+	dense = sparse.to_poly()
+	x = 0.999999
+	assert np.isclose(sparse(x), dense(x))
+	for name, reference, new in [
+			('__call__', lambda: dense(x), lambda: sparse(x)),
+			('derivative', dense.derivative, sparse.derivative),
+			('__add__', lambda: dense + dense, lambda: sparse + sparse),
+			('__str__', lambda: str(dense), lambda: str(sparse))]:
+		reference_time = timeit.timeit(reference, number=number)
+		new_time = timeit.timeit(new, number=number)
+		_report('SparsePoly {} (degree {})'.format(name, degree),
+		        reference_time, new_time)
+
+
+def benchmark_compile(degree=60, grid_size=1000000, number=3):
+	"""
+	Times a compiled evaluator against Poly.__call__ for a high degree
+	polynomial on [-1, 1] and prints the observed error, measured
+	against extended precision evaluation, next to the error bound.
+	"""
+	p = Poly(*np.random.default_rng(0).uniform(-1, 1, degree + 1))
+	x = np.random.default_rng(1).uniform(-1, 1, grid_size)
+	exact = np.polynomial.polynomial.polyval(x.astype(np.longdouble),
+	                                         p.coefs.astype(np.longdouble))
+	reference_time = timeit.timeit(lambda: p(x), number=number)
+	print('{:<40} observed error {:.3g}'.format(
+		'Poly.__call__', float(np.max(np.abs(p(x) - exact)))))
+	for method in ('chebyshev', 'piecewise'):
+		compiled = p.compile((-1, 1), method=method)
+		new_time = timeit.timeit(lambda: compiled(x), number=number)
+		_report('compile {} (degree {})'.format(method, degree),
+		        reference_time, new_time)
+		print('{:<40} observed error {:.3g}  error bound {:.3g}'.format(
+			repr(compiled)[:40], float(np.max(np.abs(compiled(x) - exact))),
+			compiled.error_bound))
+
+
+def benchmark_cache(degree=200, number=2000):
+	"""
+	Times repeated definite_integral and derivative queries on one
+	polynomial with the derived polynomial cache against the same
+	queries with the cache cleared before every call.
+	"""
+	p = Poly(*np.random.default_rng(0).uniform(-1, 1, degree + 1))
+
+	def uncached():
+		p.cache_clear()
+		p.definite_integral(0, 1)
+		p.derivative(2)
+
+	def cached():
+		p.definite_integral(0, 1)
+		p.derivative(2)
+
+	reference_time = timeit.timeit(uncached, number=number)
+	p.cache_clear()
+	new_time = timeit.timeit(cached, number=number)
+	_report('derived polynomial cache', reference_time, new_time)
+	print('{:<40} {}'.format('cache_info', p.cache_info()))
+
+
+class _ListPoly:
+	"""
+	Reference polynomial that stores its coefficients the way the
+	original Poly did, as a Python list in the instance __dict__.
+	"""
+
+	def __init__(self, *args):
+		self.coefs = list(args)
+
+
+def _bytes_per_object(factory, count):
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	objects = [factory() for _ in range(count)]
+	after = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	del objects
+	return (after - before) / count
+
+
+def benchmark_memory(degree=5, count=100000, number=20):
+	"""
+	Prints the bytes per polynomial for list backed polynomials with an
+	instance __dict__ and for the slotted array backed Poly, and times
+	p += q against p = p + q.
+	"""
+	coefs = np.random.default_rng(0).uniform(-1, 1, degree + 1).tolist()
+
+	# fresh float objects for every polynomial, as parsed or computed
+	# coefficients would be
+	reference = _bytes_per_object(
+		lambda: _ListPoly(*[c + 0.0 for c in coefs]), count)
+	new = _bytes_per_object(lambda: Poly(*[c + 0.0 for c in coefs]), count)
+	print('{:<40} reference {:>10.0f}B  new {:>10.0f}B  ratio {:>8.2f}x'
+	      .format('bytes per polynomial (degree {})'.format(degree),
+	              reference, new, reference / new))
+
+	p = Poly(*np.zeros(100000))
+	q = Poly(*np.ones(100000))
+
+	def add():
+		nonlocal p
+		p = p + q
+
+	def iadd():
+		nonlocal p
+		p += q
+
+	reference_time = timeit.timeit(add, number=number)
+	new_time = timeit.timeit(iadd, number=number)
+	_report('p += q (100000 coefficients)', reference_time, new_time)
+
+
+def _naive_divmod(a, b):
+	"""
+	Reference long division on Python lists, one coefficient at a time.
+	"""
+	remainder = list(a)
+	quotient = [0.0] * (len(a) - len(b) + 1)
+	for k in range(len(quotient) - 1, -1, -1):
+		quotient[k] = remainder[k + len(b) - 1] / b[-1]
+		for i in range(len(b)):
+			remainder[k + i] -= quotient[k] * b[i]
+	return quotient, remainder[:len(b) - 1]
+
+
+def benchmark_division(sizes=(16, 32, 64, 256, 1024), number=3):
+	"""
+	Times divmod on Poly objects, whose quotient and divisor have size
+	coefficients, against long division on Python lists, and prints the
+	schoolbook and Newton iteration times that DIVISION_CUTOFF is read
+	off.
+	"""
+	rng = np.random.default_rng(0)
+	print('{:>6} {:>12} {:>12}'.format('size', 'schoolbook', 'newton'))
+	for size in sizes:
+		a = rng.uniform(-1, 1, 2 * size - 1)
+		b = rng.uniform(-1, 1, size)
+		b[-1] = 2.0
+		print('{:>6} {:>12.6f} {:>12.6f}'.format(
+			size,
+			_best_time(lambda: polynomial._schoolbook_divmod(a.copy(), b),
+			           number),
+			_best_time(lambda: polynomial._fast_divmod(a, b), number)))
+
+	for size in sizes:
+		a = rng.uniform(-1, 1, 2 * size - 1)
+		b = rng.uniform(-1, 1, size)
+		b[-1] = 2.0
+		p, q = Poly(*a), Poly(*b)
+		reference_time = timeit.timeit(
+			lambda: _naive_divmod(a.tolist(), b.tolist()), number=number)
+		new_time = timeit.timeit(lambda: divmod(p, q), number=number)
+		_report('divmod ({} coefficients)'.format(size),
+		        reference_time, new_time)
+
+
+def benchmark_compose(sizes=(16, 64, 256), number=3):
+	"""
+	Times compose(p, q) for a quadratic q against Horner's scheme built
+	from Poly.__mul__ and Poly.__add__.
+	"""
+	rng = np.random.default_rng(0)
+	q = Poly(*rng.uniform(-1, 1, 3))
+	for size in sizes:
+		p = Poly(*rng.uniform(-1, 1, size))
+
+		def naive():
+			rv = Poly(p.coefs[-1])
+			for c in p.coefs[-2::-1]:
+				rv = rv * q + Poly(c)
+			return rv
+
+		expected = naive().coefs
+		assert np.allclose(compose(p, q).coefs, expected,
+		                   atol=1e-9 * np.abs(expected).max())
+		reference_time = timeit.timeit(naive, number=number)
+		new_time = timeit.timeit(lambda: compose(p, q), number=number)
+		_report('compose ({} coefficients)'.format(size),
+		        reference_time, new_time)
+
+
+def benchmark_evaluate_many(sizes=(64, 256, 1024), number=1):
+	"""
+	Times exact evaluate_many at as many integer points as the
+	polynomial has coefficients against one __call__ per point.
+	"""
+	rng = np.random.default_rng(0)
+	for size in sizes:
+		p = Poly(*rng.integers(-9, 9, size).tolist())
+		points = rng.integers(-50, 50, size)
+		assert list(p.evaluate_many(points)) \
+		       == [p(x) for x in points.tolist()]
+		reference_time = timeit.timeit(
+			lambda: [p(x) for x in points.tolist()], number=number)
+		new_time = timeit.timeit(lambda: p.evaluate_many(points),
+		                         number=number)
+		_report('evaluate_many ({} points)'.format(size),
+		        reference_time, new_time)
+
+
+if __name__ == '__main__':
+
+	benchmark_call()
+	benchmark_batch()
+	benchmark_multiply()
+	benchmark_roots()
+	benchmark_extrema()
+	benchmark_sparse()
+	benchmark_compile()
+	benchmark_cache()
+	benchmark_memory()
+	benchmark_division()
+	benchmark_compose()
+	benchmark_evaluate_many()
+	benchmark_multiply_crossover()